@@ -3,9 +3,11 @@ import time
 from datetime import datetime
 from decimal import Decimal
 import resend
+import redis
 
 from shared.db import get_conn, init_pool
 from shared.settings import settings
+from shared.zone_state import read_zone_states
 from alerter.email_templates import get_alert_html
 
 # --- Configuración ---
@@ -19,7 +21,43 @@ ALERT_EMAIL_TO = settings.alert_email_to
 # Formato: {(zone_id, metric): "triggered"}
 alert_states = {}
 
+redis_client = redis.from_url(settings.redis_url.unicode_string(), decode_responses=True)
+
+
 def _get_current_metrics() -> dict:
+    """
+    Métricas actuales de ocupación y dwell time desde el estado en vivo que
+    publica el worker en Redis (O(zonas)). Las zonas sin estado vigente (worker
+    caído o sin publicar) se completan desde la base de datos, igual que el API.
+    """
+    try:
+        states = read_zone_states(redis_client)
+    except redis.RedisError as e:
+        print(f"Error leyendo el estado en vivo de Redis: {e}")
+        states = {}
+
+    metrics = {}
+    for zone_id, state in states.items():
+        metrics[zone_id] = {'occupancy': state['occupancy']}
+        if state['avg_dwell_seconds_5m'] is not None:
+            metrics[zone_id]['dwell'] = state['avg_dwell_seconds_5m']
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM zones")
+            configured = {row[0] for row in cur.fetchall()}
+    missing = configured - metrics.keys()
+    if not metrics or missing:
+        db_metrics = _get_db_metrics()
+        if not metrics:
+            return db_metrics
+        for zone_id in missing:
+            if zone_id in db_metrics:
+                metrics[zone_id] = db_metrics[zone_id]
+    return metrics
+
+
+def _get_db_metrics() -> dict:
     """
     Calcula las métricas actuales de ocupación y dwell time.
     Es una copia de la lógica del API para mantener consistencia.
@@ -27,17 +65,13 @@ def _get_current_metrics() -> dict:
     metrics = {}
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # 1. Ocupación
+            # 1. Ocupación: visitas abiertas dentro del ghost timeout de la zona
             cur.execute(
                 """
-                WITH last_events AS (
-                    SELECT DISTINCT ON (zone_id, track_id) zone_id, event, ts
-                    FROM zone_events ORDER BY zone_id, track_id, ts DESC
-                )
-                SELECT zone_id, COUNT(*) AS occupancy
-                FROM last_events
-                WHERE event = 'enter' AND ts > NOW() - INTERVAL '20 minutes'
-                GROUP BY zone_id;
+                SELECT v.zone_id, COUNT(*) AS occupancy
+                FROM zone_visits v JOIN zones z ON v.zone_id = z.id
+                WHERE v.exit_ts IS NULL AND v.enter_ts > NOW() - (z.ghost_timeout_minutes * INTERVAL '1 minute')
+                GROUP BY v.zone_id;
                 """
             )
             for row in cur.fetchall():
@@ -3,10 +3,13 @@ from sse_starlette.sse import EventSourceResponse
 from datetime import datetime, timedelta
 from shared.db import get_conn, init_pool
 from shared.settings import settings
+from shared.viewers import VIEWER_HEARTBEAT_SECONDS, VIEWER_TTL_SECONDS, annotated_frame_key, viewers_key
+from shared.zone_state import read_zone_states_async
 import asyncio
 import json
 from decimal import Decimal
 import time
+import uuid
 import psycopg2
 
 # --- FIX: Añadir Middleware de CORS ---
@@ -48,13 +51,65 @@ def robust_json_encoder(obj):
 def health():
     return {"status": "ok", "time": datetime.utcnow().isoformat()}
 
-def _snapshot():
+async def _live_snapshot() -> dict:
     """
-    Calcula un snapshot de las métricas actuales (ocupación y dwell time)
-    consultando la base de datos.
-    Implementa reintentos para manejar conexiones de BD inestables.
+    Métricas actuales desde el estado en vivo que publica el worker: O(zonas),
+    sin consultar la base de datos. Vacío si ningún worker publicó dentro del TTL.
+    """
+    metrics = {}
+    for zone_id, state in (await read_zone_states_async(redis_client)).items():
+        metrics[zone_id] = {'occupancy': state['occupancy']}
+        if state['avg_dwell_seconds_5m'] is not None:
+            metrics[zone_id]['avg_dwell_seconds_5m'] = state['avg_dwell_seconds_5m']
+    return metrics
+
+
+# Cada cuánto se relee la lista de zonas configuradas (tabla zones)
+ZONE_IDS_REFRESH_SECONDS = 60
+_zone_ids = set()
+_zone_ids_loaded_at = 0.0
+
+
+def _configured_zone_ids() -> set:
+    """Ids de la tabla zones, cacheados ZONE_IDS_REFRESH_SECONDS. Si la base falla se usa la última lista."""
+    global _zone_ids, _zone_ids_loaded_at
+    if time.monotonic() - _zone_ids_loaded_at >= ZONE_IDS_REFRESH_SECONDS:
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT id FROM zones")
+                    _zone_ids = {row[0] for row in cur.fetchall()}
+            _zone_ids_loaded_at = time.monotonic()
+        except psycopg2.Error as e:
+            print(f"Error leyendo las zonas configuradas: {e}")
+    return _zone_ids
+
+
+async def _snapshot():
+    """
+    Snapshot de las métricas actuales (ocupación y dwell time). Se lee del estado
+    en vivo del worker en Redis; las zonas sin estado vigente (su worker está
+    caído o no publicó dentro del TTL) se completan desde la base de datos.
     """
     now = datetime.utcnow()
+    metrics = await _live_snapshot()
+    missing = _configured_zone_ids() - metrics.keys()
+    if not metrics or missing:
+        db_metrics = _db_metrics()
+        if not metrics:
+            metrics = db_metrics
+        else:
+            for zone_id in missing:
+                if zone_id in db_metrics:
+                    metrics[zone_id] = db_metrics[zone_id]
+    return {"timestamp": now.isoformat() + "Z", "zones": metrics}
+
+
+def _db_metrics():
+    """
+    Calcula las métricas actuales (ocupación y dwell time) consultando la base de datos.
+    Implementa reintentos para manejar conexiones de BD inestables.
+    """
     metrics = {}
     
     max_retries = 3
@@ -62,29 +117,22 @@ def _snapshot():
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    # 1. Obtener la ocupación actual por zona (consulta mejorada)
+                    # 1. Ocupación actual por zona: visitas abiertas dentro del ghost timeout de la zona
+                    # (range scan sobre el índice parcial de zone_visits, sin recorrer zone_events)
                     cur.execute(
                         """
-                        WITH last_events AS (
-                            SELECT DISTINCT ON (zone_id, track_id)
-                                   zone_id,
-                                   event,
-                                   ts
-                            FROM zone_events
-                            ORDER BY zone_id, track_id, ts DESC
-                        )
                         SELECT
-                            le.zone_id,
+                            v.zone_id,
                             COUNT(*) AS occupancy
                         FROM
-                            last_events le
+                            zone_visits v
                         JOIN
-                            zones z ON le.zone_id = z.id
+                            zones z ON v.zone_id = z.id
                         WHERE
-                            le.event = 'enter'
-                            AND le.ts > NOW() - (z.ghost_timeout_minutes * INTERVAL '1 minute')
+                            v.exit_ts IS NULL
+                            AND v.enter_ts > NOW() - (z.ghost_timeout_minutes * INTERVAL '1 minute')
                         GROUP BY
-                            le.zone_id;
+                            v.zone_id;
                         """
                     )
                     occupancy_rows = cur.fetchall()
@@ -123,15 +171,13 @@ def _snapshot():
                 # Devolver métricas vacías si todos los reintentos fallan
                 metrics = {} 
     
-    # Formatear el resultado final
-    data = {"timestamp": now.isoformat() + "Z", "zones": metrics}
-    return data
+    return metrics
 
 @app.get("/realtime/stream")
 async def stream():
     async def gen():
         while True:
-            snapshot_data = _snapshot()
+            snapshot_data = await _snapshot()
             # Convertimos manualmente el diccionario a un string JSON usando nuestro encoder robusto
             json_payload = json.dumps(snapshot_data, default=robust_json_encoder)
             yield {"event": "metrics", "data": json_payload}
@@ -139,19 +185,41 @@ async def stream():
     return EventSourceResponse(gen())
 
 @app.get("/video/stream/{camera_id}")
-async def video_stream(camera_id: int):
+async def video_stream(camera_id: int, fps: float = 20.0):
+    # Cada conexión se registra como espectador: el worker sólo anota y codifica
+    # frames de esta cámara mientras haya alguien mirando, y a lo sumo a estos fps.
+    fps = min(max(fps, 1.0), 30.0)
+    viewer_id = uuid.uuid4().hex
+    key = viewers_key(camera_id)
+
     async def frame_generator():
-        while True:
-            # CAMBIO 3: Usamos 'await' para la llamada asíncrona a Redis
-            frame_bytes = await redis_client.get(f"annotated_frame_cam_{camera_id}")
-            
-            if frame_bytes:
-                # El formato MJPEG requiere estos encabezados especiales entre cada frame
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            # Controla la fluidez del stream. Un valor más bajo = más FPS (pero más carga en la red).
-            # 0.05 equivale a ~20 FPS.
-            await asyncio.sleep(0.05) 
+        last_heartbeat = 0.0
+        try:
+            while True:
+                now = time.monotonic()
+                if now - last_heartbeat >= VIEWER_HEARTBEAT_SECONDS:
+                    async with redis_client.pipeline(transaction=False) as pipe:
+                        pipe.zadd(key, {viewer_id: fps})
+                        pipe.expire(key, VIEWER_TTL_SECONDS)
+                        await pipe.execute()
+                    last_heartbeat = now
+
+                # CAMBIO 3: Usamos 'await' para la llamada asíncrona a Redis
+                frame_bytes = await redis_client.get(annotated_frame_key(camera_id))
+
+                if frame_bytes:
+                    # El formato MJPEG requiere estos encabezados especiales entre cada frame
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+
+                # Controla la fluidez del stream según los fps pedidos por el cliente.
+                await asyncio.sleep(1.0 / fps)
+        finally:
+            # El cliente cerró la conexión: dejar de contar como espectador
+            # (si falla, el TTL del set se encarga)
+            try:
+                await redis_client.zrem(key, viewer_id)
+            except Exception:
+                pass
 
     return StreamingResponse(frame_generator(), media_type="multipart/x-mixed-replace; boundary=frame")
@@ -1,73 +1,214 @@
 import os
+import atexit
 import cv2
 import redis
 import time
-import json
-import base64
-import yaml
-from pathlib import Path
+import threading
 from shared.settings import settings
+from shared.camera_config import find_camera, load_config, tenant_cameras, zone_reference
+from shared.frame_queue import FRAMES_QUEUE_MAXLEN, frames_stats_key, push_frame
+from shared.shm_ring import FrameRing
+from shared.frame_codec import ENCODING_BGR, ENCODING_JPEG, ENCODING_SHM, encode_frame
+from capture.reader import DeadlinePacer, LatestFrameReader
+from capture.motion import MotionGate
 
-CONFIG_PATH = Path(__file__).resolve().parent.parent / "config.yaml"
-FRAMES_QUEUE_KEY = os.getenv("REDIS_FRAMES_QUEUE", "frames_queue")
 CAMERA_ID = int(os.getenv("CAMERA_ID", 1))
+# Si se define, un único proceso captura todas las cámaras del tenant (ignora CAMERA_ID)
+CAPTURE_TENANT_ID = os.getenv("CAPTURE_TENANT_ID")
+# Formato de transporte: "jpeg" (binario v1 + JPEG) o "raw" (binario v1 + BGR crudo)
+WIRE_FORMAT = os.getenv("FRAME_WIRE_FORMAT", "jpeg").lower()
+# "shm": los frames van por memoria compartida y Redis sólo lleva la notificación.
+# Requiere que el worker corra en el mismo host; para workers remotos usar "redis".
+FRAME_TRANSPORT = os.getenv("FRAME_TRANSPORT", "redis").lower()
+# "latest": thread que vacía el stream y publica sólo el frame más nuevo (default)
+# "sequential": lectura directa con cap.read(), útil para archivos de video
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "latest").lower()
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 60))
+# Activa el filtro de movimiento en todas las cámaras (también se puede activar por cámara
+# con la sección `motion_gate` en config.yaml)
+MOTION_GATE = os.getenv("MOTION_GATE", "0") == "1"
 
-# --- Cargar configuración específica de la cámara ---
-with open(CONFIG_PATH, "r") as f:
-    cfg = yaml.safe_load(f)
-
-cam_cfg = None
-for tenant in cfg.get("tenants", []):
-    for c in tenant.get("cameras", []):
-        if c["id"] == CAMERA_ID:
-            cam_cfg = c
-            break
-    if cam_cfg:
-        break
-
-if cam_cfg is None:
-    raise RuntimeError(f"Capture service: Camera id {CAMERA_ID} not found in config")
-
-RTSP_URL = cam_cfg.get("rtsp_url")
-FPS = cam_cfg.get("fps", 10) # Usamos un FPS configurable o default a 10
-FRAME_INTERVAL = 1.0 / FPS
-
-# --- Conexión a Redis ---
-redis_client = redis.from_url(settings.redis_url.unicode_string())
-
-# --- Bucle principal de captura ---
-print(f"Capture service started for Camera ID: {CAMERA_ID} at {FPS} FPS")
-
-cap = cv2.VideoCapture(RTSP_URL)
-
-while True:
-    if not cap.isOpened():
-        print(f"Capture service: Stream for camera {CAMERA_ID} disconnected. Reconnecting...")
-        cap.release()
-        cap = cv2.VideoCapture(RTSP_URL)
-        time.sleep(5.0)
-        continue
-
-    ok, frame = cap.read()
-    if not ok:
-        print(f"Capture service: Cannot read frame from camera {CAMERA_ID}. Reconnecting...")
-        cap.release()
-        time.sleep(5.0)
-        continue
-
-    # Codificar el frame a JPEG y luego a base64
-    _, buffer = cv2.imencode('.jpg', frame)
-    frame_b64 = base64.b64encode(buffer).decode('utf-8')
-
-    # Crear el payload
-    payload = {
-        "camera_id": CAMERA_ID,
-        "ts": time.time(),
-        "frame_b64": frame_b64
-    }
-
-    # Empujar a la cola de Redis
-    redis_client.rpush(FRAMES_QUEUE_KEY, json.dumps(payload))
-    
-    # Esperar el intervalo de tiempo correcto para mantener el FPS deseado
-    time.sleep(FRAME_INTERVAL)
+
+class CameraCapture:
+    """Captura y publicación de una cámara. Varias instancias comparten el pool de Redis."""
+
+    def __init__(self, cam_cfg: dict, redis_client):
+        self.camera_id = cam_cfg["id"]
+        self.rtsp_url = cam_cfg.get("rtsp_url")
+        self.fps = cam_cfg.get("fps", 10) # Usamos un FPS configurable o default a 10
+        # Longitud máxima de la cola de esta cámara; al superarla se descartan los frames más viejos
+        self.queue_maxlen = int(cam_cfg.get("queue_maxlen", FRAMES_QUEUE_MAXLEN))
+        # Resolución (ancho, alto) a la que se reduce el frame antes de codificarlo, p. ej. el
+        # tamaño de entrada del modelo; no tiene sentido transportar píxeles que YOLO descarta
+        resolution = cam_cfg.get("capture_resolution")
+        self.capture_resolution = tuple(resolution) if resolution else None
+        self.jpeg_params = []
+        if cam_cfg.get("jpeg_quality") is not None:
+            self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, int(cam_cfg["jpeg_quality"])]
+        if self.capture_resolution and any(
+            zone_reference(cam_cfg, z) is None for z in cam_cfg.get("zones", [])
+        ):
+            print(f"Capture service: camera {self.camera_id} usa capture_resolution pero sus zonas no declaran "
+                  f"`zone_resolution`; los polígonos se interpretarán en {self.capture_resolution}")
+        self.redis = redis_client
+        self.seq = 0
+        self.ring = None
+
+        # Filtro de movimiento restringido a la unión de los polígonos de zona
+        gate_cfg = cam_cfg.get("motion_gate", MOTION_GATE)
+        self.motion_gate = None
+        if gate_cfg and (not isinstance(gate_cfg, dict) or gate_cfg.get("enabled", True)):
+            zones = [(z["polygon"], zone_reference(cam_cfg, z)) for z in cam_cfg.get("zones", []) if z.get("polygon")]
+            self.motion_gate = MotionGate.from_config(gate_cfg, zones)
+
+    def publish(self, frame, ts):
+        """Codifica el frame según el transporte configurado y lo empuja a la cola de la cámara."""
+        self.seq += 1
+        height, width = frame.shape[:2]
+        if FRAME_TRANSPORT == "shm":
+            if self.ring is None or self.ring.shape != frame.shape:
+                # Primer frame o cambio de resolución del stream: (re)crear el ring
+                if self.ring is not None:
+                    self.ring.close()
+                self.ring = FrameRing.create(self.camera_id, height, width)
+            # Redis sólo lleva la notificación; el worker lee el slot `seq` del ring
+            self.seq = self.ring.write(frame, ts)
+            data = encode_frame(self.camera_id, self.seq, ts, b"", ENCODING_SHM, width, height)
+        elif WIRE_FORMAT == "raw":
+            # Píxeles BGR tal cual: más bytes en Redis pero cero encode/decode
+            data = encode_frame(self.camera_id, self.seq, ts, frame, ENCODING_BGR, width, height)
+        else:
+            _, buffer = cv2.imencode('.jpg', frame, self.jpeg_params)
+            data = encode_frame(self.camera_id, self.seq, ts, buffer, ENCODING_JPEG, width, height)
+
+        # Empujar a la cola acotada de esta cámara (gana el frame más reciente)
+        push_frame(self.redis, self.camera_id, data, self.queue_maxlen)
+
+    def process(self, frame, ts) -> bool:
+        """
+        Reduce, filtra por movimiento y publica un frame leído del stream.
+        Devuelve False si el frame no se publicó. Es el camino que usa también el replay offline.
+        """
+        if self.capture_resolution and (frame.shape[1], frame.shape[0]) != self.capture_resolution:
+            frame = cv2.resize(frame, self.capture_resolution, interpolation=cv2.INTER_AREA)
+
+        # Frames estáticos: no se publican (salvo keep-alive), ahorrando su inferencia
+        if self.motion_gate is not None and not self.motion_gate.should_publish(frame, ts):
+            return False
+
+        self.publish(frame, ts)
+        return True
+
+    def run(self):
+        print(f"Capture service started for Camera ID: {self.camera_id} at {self.fps} FPS (mode: {CAPTURE_MODE})")
+
+        # Publicamos sobre deadlines absolutos: el tiempo de encode y push no retrasa el siguiente frame
+        pacer = DeadlinePacer(self.fps)
+        last_stats_ts = time.time()
+
+        if CAPTURE_MODE == "latest":
+            # Un thread vacía el stream con grab() y sólo conserva el frame más reciente;
+            # se reconecta por su cuenta sin afectar a las demás cámaras del proceso
+            reader = LatestFrameReader(self.rtsp_url, self.camera_id).start()
+        else:
+            cap = cv2.VideoCapture(self.rtsp_url)
+
+        while True:
+            pacer.wait()
+
+            if CAPTURE_MODE == "latest":
+                frame, frame_ts = reader.latest()
+                if frame is None:
+                    # Aún no hay un frame nuevo (arranque o reconexión del stream): el reader sigue
+                    # decodificando hasta que se tome uno
+                    continue
+                reader.request(pacer.next_deadline)
+            else:
+                if not cap.isOpened():
+                    print(f"Capture service: Stream for camera {self.camera_id} disconnected. Reconnecting...")
+                    cap.release()
+                    cap = cv2.VideoCapture(self.rtsp_url)
+                    time.sleep(5.0)
+                    continue
+
+                ok, frame = cap.read()
+                if not ok:
+                    print(f"Capture service: Cannot read frame from camera {self.camera_id}. Reconnecting...")
+                    cap.release()
+                    time.sleep(5.0)
+                    continue
+                frame_ts = time.time()
+
+            try:
+                if not self.process(frame, frame_ts):
+                    continue
+            except redis.RedisError as e:
+                print(f"Capture service: Error publicando frame de la cámara {self.camera_id}: {e}")
+                continue
+            pacer.record(frame_ts)
+
+            if time.time() - last_stats_ts >= STATS_INTERVAL:
+                stats = pacer.report()
+                if self.motion_gate is not None:
+                    stats.update(self.motion_gate.report())
+                try:
+                    self.redis.hset(frames_stats_key(self.camera_id), mapping=stats)
+                except redis.RedisError as e:
+                    print(f"Capture service: Error publicando métricas de la cámara {self.camera_id}: {e}")
+                print(f"Capture service: camera {self.camera_id} -> {stats['fps']} fps (objetivo {self.fps}), "
+                      f"edad media del frame {stats['frame_age_ms']} ms")
+                if self.motion_gate is not None:
+                    print(f"Capture service: camera {self.camera_id} -> {stats['motion_skipped']} frames estáticos "
+                          f"descartados ({stats['motion_saved_pct']}% de inferencia ahorrada)")
+                last_stats_ts = time.time()
+
+    def close(self):
+        # Liberar el segmento de memoria compartida al salir
+        if self.ring is not None:
+            self.ring.close()
+
+
+def main():
+    cfg = load_config()
+
+    if CAPTURE_TENANT_ID:
+        cameras = tenant_cameras(cfg, int(CAPTURE_TENANT_ID))
+        if not cameras:
+            raise RuntimeError(f"Capture service: Tenant id {CAPTURE_TENANT_ID} has no cameras in config")
+    else:
+        _, cam_cfg = find_camera(cfg, CAMERA_ID)
+        if cam_cfg is None:
+            raise RuntimeError(f"Capture service: Camera id {CAMERA_ID} not found in config")
+        cameras = [cam_cfg]
+
+    # --- Conexión a Redis ---
+    # Un único pool compartido por todas las cámaras del proceso (redis-py es thread-safe)
+    pool = redis.ConnectionPool.from_url(settings.redis_url.unicode_string(), max_connections=2 * len(cameras) + 2)
+    redis_client = redis.Redis(connection_pool=pool)
+
+    captures = [CameraCapture(cam_cfg, redis_client) for cam_cfg in cameras]
+    for capture in captures:
+        atexit.register(capture.close)
+
+    if len(captures) == 1:
+        captures[0].run()
+        return
+
+    print(f"Capture service: {len(captures)} cámaras del tenant {CAPTURE_TENANT_ID} en un solo proceso")
+    threads = [
+        threading.Thread(target=capture.run, name=f"capture-cam-{capture.camera_id}", daemon=True)
+        for capture in captures
+    ]
+    for t in threads:
+        t.start()
+    # Threads daemon: el proceso termina con Ctrl+C / SIGTERM en el hilo principal
+    while all(t.is_alive() for t in threads):
+        time.sleep(1.0)
+    # Si una cámara deja de publicar (p. ej. una excepción de cv2 en su thread) se termina el
+    # contenedor para que lo reinicie el orquestador, en lugar de seguir vivo sin esa cámara
+    dead = [t.name for t in threads if not t.is_alive()]
+    raise SystemExit(f"Capture service: terminó inesperadamente {', '.join(dead)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Pre-filtro de movimiento en el capture.
+
+Compara cada frame con el anterior sobre una versión reducida en escala de
+grises, mirando sólo los píxeles dentro de la unión de los polígonos de zona.
+Los frames estáticos no se publican (salvo un keep-alive periódico para que el
+worker siga viendo a quien está quieto dentro de una zona), con lo que se
+ahorra la inferencia YOLO correspondiente.
+"""
+import cv2
+import numpy as np
+
+from shared.camera_config import scale_polygon
+
+
+class MotionGate:
+    def __init__(self, zones, width: int = 160, pixel_threshold: int = 25,
+                 min_changed_ratio: float = 0.002, keepalive_seconds: float = 5.0,
+                 hold_seconds: float = 2.0):
+        # Lista de (puntos, resolución de referencia o None); se escalan al tamaño del frame
+        self.zones = list(zones)
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.keepalive_seconds = keepalive_seconds
+        # Tras detectar movimiento se sigue publicando un rato para no cortar los tracks
+        self.hold_seconds = hold_seconds
+
+        self._shape = None
+        self._small_size = None
+        self._mask = None
+        self._mask_area = 0
+        self._prev = None
+        self._last_motion_ts = 0.0
+        self._last_publish_ts = 0.0
+        self.published = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, gate_cfg, zones) -> "MotionGate":
+        """`gate_cfg` es la sección `motion_gate` de la cámara (dict) o True para usar los defaults."""
+        gate_cfg = gate_cfg if isinstance(gate_cfg, dict) else {}
+        return cls(
+            zones,
+            width=int(gate_cfg.get("width", 160)),
+            pixel_threshold=int(gate_cfg.get("pixel_threshold", 25)),
+            min_changed_ratio=float(gate_cfg.get("min_changed_ratio", 0.002)),
+            keepalive_seconds=float(gate_cfg.get("keepalive_seconds", 5.0)),
+            hold_seconds=float(gate_cfg.get("hold_seconds", 2.0)),
+        )
+
+    def _build_mask(self, frame_shape):
+        height, width = frame_shape[:2]
+        scale = self.width / width
+        small_size = (self.width, max(1, int(round(height * scale))))
+        mask = np.zeros((small_size[1], small_size[0]), dtype=np.uint8)
+        if self.zones:
+            pts = [
+                np.round(np.asarray(scale_polygon(points, ref, (width, height))) * scale)
+                .astype(np.int32).reshape((-1, 1, 2))
+                for points, ref in self.zones
+            ]
+            cv2.fillPoly(mask, pts, 255)
+        else:
+            mask[:] = 255
+        self._shape = frame_shape
+        self._small_size = small_size
+        self._mask = mask
+        self._mask_area = max(1, cv2.countNonZero(mask))
+        self._prev = None
+
+    def _has_motion(self, frame) -> bool:
+        if frame.shape != self._shape:
+            self._build_mask(frame.shape)
+        small = cv2.resize(frame, self._small_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        prev, self._prev = self._prev, gray
+        if prev is None:
+            return True
+
+        diff = cv2.absdiff(gray, prev)
+        _, changed = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+        changed = cv2.bitwise_and(changed, self._mask)
+        return cv2.countNonZero(changed) / self._mask_area >= self.min_changed_ratio
+
+    def should_publish(self, frame, now: float) -> bool:
+        if self._has_motion(frame):
+            self._last_motion_ts = now
+        publish = (
+            now - self._last_motion_ts <= self.hold_seconds
+            or now - self._last_publish_ts >= self.keepalive_seconds
+        )
+        if publish:
+            self._last_publish_ts = now
+            self.published += 1
+        else:
+            self.skipped += 1
+        return publish
+
+    def report(self) -> dict:
+        """Contadores acumulados: frames estáticos descartados = inferencias ahorradas en el worker."""
+        total = self.published + self.skipped
+        return {
+            "motion_published": self.published,
+            "motion_skipped": self.skipped,
+            "motion_saved_pct": round(100.0 * self.skipped / total, 1) if total else 0.0,
+        }
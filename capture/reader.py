@@ -0,0 +1,124 @@
+"""
+Lectura del stream con el frame más reciente y publicación a ritmo fijo.
+
+`LatestFrameReader` vacía el stream en un thread con `grab()` para que el buffer
+RTSP nunca se acumule, y sólo decodifica (`retrieve()`) los frames que caen
+cerca del próximo deadline de publicación, más el primero que llega después de
+que se entregó el anterior: así siempre hay un frame listo para el deadline
+aunque el intervalo entre frames de la cámara sea mayor que el margen.
+`DeadlinePacer` publica sobre deadlines absolutos, de modo que el tiempo de
+encode y push no se suma al intervalo como ocurría con `time.sleep(FRAME_INTERVAL)`.
+"""
+import threading
+import time
+
+import cv2
+
+RECONNECT_DELAY = 5.0
+
+
+class LatestFrameReader:
+    """Thread que mantiene sólo el último frame decodificado de un stream."""
+
+    def __init__(self, url: str, camera_id: int, lead: float = 0.05):
+        self.url = url
+        self.camera_id = camera_id
+        # Margen antes del deadline a partir del cual se decodifican los frames
+        self.lead = lead
+        self._retrieve_after = 0.0
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frame_ts = 0.0
+        self._frame_id = 0
+        self._taken_id = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"reader-cam-{camera_id}", daemon=True)
+
+    def start(self) -> "LatestFrameReader":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=RECONNECT_DELAY)
+
+    def request(self, deadline: float):
+        """Indica cuándo se va a publicar el próximo frame para decodificar sólo los cercanos."""
+        self._retrieve_after = deadline - self.lead
+
+    def latest(self):
+        """Devuelve (frame, ts_de_captura) del frame más nuevo no entregado aún, o (None, None)."""
+        with self._lock:
+            if self._frame is None or self._frame_id == self._taken_id:
+                return None, None
+            self._taken_id = self._frame_id
+            return self._frame, self._frame_ts
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.url)
+        # Con el backend FFmpeg no siempre se respeta, pero evita acumular frames donde sí
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        cap = self._open()
+        while not self._stop.is_set():
+            if not cap.isOpened() or not cap.grab():
+                print(f"Capture service: Stream for camera {self.camera_id} disconnected. Reconnecting...")
+                cap.release()
+                time.sleep(RECONNECT_DELAY)
+                cap = self._open()
+                continue
+
+            grabbed_ts = time.time()
+            # Lejos del deadline, y con un frame ya decodificado esperando, sólo vaciamos el buffer;
+            # cerca de él decodificamos para entregar el más nuevo
+            if grabbed_ts < self._retrieve_after and self._frame_id != self._taken_id:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+            with self._lock:
+                self._frame = frame
+                self._frame_ts = grabbed_ts
+                self._frame_id += 1
+        cap.release()
+
+
+class DeadlinePacer:
+    """Espera hasta deadlines absolutos a `fps` y mide los fps reales y la edad de los frames."""
+
+    def __init__(self, fps: float):
+        self.interval = 1.0 / fps
+        self.next_deadline = time.time()
+        self._window_start = time.time()
+        self._published = 0
+        self._age_sum = 0.0
+
+    def wait(self):
+        now = time.time()
+        if self.next_deadline > now:
+            time.sleep(self.next_deadline - now)
+        elif now - self.next_deadline > self.interval:
+            # Vamos más de un intervalo atrasados: re-sincronizar en vez de publicar en ráfaga
+            self.next_deadline = now
+        deadline = self.next_deadline
+        self.next_deadline += self.interval
+        return deadline
+
+    def record(self, frame_ts: float):
+        self._published += 1
+        self._age_sum += time.time() - frame_ts
+
+    def report(self) -> dict:
+        """Devuelve fps logrados y edad media de los frames desde el último reporte y reinicia la ventana."""
+        now = time.time()
+        elapsed = max(now - self._window_start, 1e-6)
+        stats = {
+            "fps": round(self._published / elapsed, 2),
+            "frame_age_ms": round(1000 * self._age_sum / self._published, 1) if self._published else 0.0,
+        }
+        self._window_start = now
+        self._published = 0
+        self._age_sum = 0.0
+        return stats
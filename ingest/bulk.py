@@ -0,0 +1,55 @@
+"""
+Escritura masiva de eventos de zona en TimescaleDB.
+
+`copy_rows` serializa el lote a CSV en un buffer en memoria y lo envía con
+COPY ... FROM STDIN: el servidor parsea filas en streaming en lugar de un
+INSERT gigante armado en Python, así que escala a lotes de miles de filas.
+`insert_values` es el camino anterior (execute_values), que se conserva para
+comparar y como alternativa con INGEST_WRITE_MODE=values.
+
+Las escrituras son idempotentes sobre el índice único (event_key, ts): en una
+hypertable todo índice único tiene que incluir la columna de partición, y ts
+es parte del evento, así que un duplicado tiene la misma clave y el mismo ts.
+COPY no admite ON CONFLICT, así que `copy_rows` copia a una tabla temporal de
+la sesión (vacía en cada commit) y de ahí hace un único INSERT ... SELECT ...
+ON CONFLICT DO NOTHING, que también descarta duplicados dentro del lote.
+"""
+import csv
+import io
+
+from psycopg2.extras import execute_values
+
+EVENT_COLUMNS = ("tenant_id", "camera_id", "zone_id", "track_id", "event", "ts", "dwell_seconds", "event_key")
+CONFLICT_COLUMNS = ("event_key", "ts")
+
+
+def rows_to_csv(rows) -> io.StringIO:
+    """CSV en memoria listo para COPY. None se escribe como campo vacío sin comillas, que COPY lee como NULL."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(cur, rows, table: str = "zone_events", columns=EVENT_COLUMNS, conflict=CONFLICT_COLUMNS) -> int:
+    """COPY a la tabla temporal `{table}_stage` y de ahí a `table` sin duplicados. Devuelve las filas insertadas."""
+    stage = f"{table}_stage"
+    cols = ", ".join(columns)
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} ON COMMIT DELETE ROWS AS SELECT {cols} FROM {table} WITH NO DATA")
+    cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv)", rows_to_csv(rows))
+    cur.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage} ON CONFLICT ({', '.join(conflict)}) DO NOTHING")
+    return cur.rowcount
+
+
+def insert_values(cur, rows, table: str = "zone_events", columns=EVENT_COLUMNS, conflict=CONFLICT_COLUMNS,
+                  page_size: int = 1000):
+    """Devuelve las filas insertadas (los duplicados no cuentan)."""
+    inserted = execute_values(
+        cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT ({', '.join(conflict)}) DO NOTHING RETURNING 1",
+        rows, page_size=page_size, fetch=True,
+    )
+    return len(inserted)
+
+
+WRITERS = {"copy": copy_rows, "values": insert_values}
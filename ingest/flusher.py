@@ -0,0 +1,51 @@
+"""
+Escritura asíncrona de lotes para ingest (INGEST_FLUSH_MODE=async).
+
+El consumidor arma el lote siguiente mientras un thread escribe el anterior:
+doble buffer, así un commit lento o los backoffs de `_flush_batch` no frenan
+la lectura del stream. Los lotes se escriben en el orden en que se entregan.
+A lo sumo INGEST_MAX_INFLIGHT lotes pueden estar esperando o escribiéndose:
+con ese tope alcanzado `submit` bloquea, y la presión vuelve al stream de
+Redis, donde los eventos esperan sin confirmar.
+"""
+import os
+import queue
+import threading
+
+MAX_INFLIGHT = int(os.getenv("INGEST_MAX_INFLIGHT", 2))
+
+
+class AsyncFlusher(threading.Thread):
+    """
+    `write(batch, ids) -> bool` escribe y confirma un lote; si devuelve False
+    (base caída y sin journal disponible) se reintenta el mismo lote hasta que
+    pase, sin adelantar los siguientes. Si lanza una excepción, el lote se
+    abandona (queda sin confirmar en el stream) y se llama a `on_error(batch, ids)`.
+    """
+
+    def __init__(self, write, max_inflight: int = MAX_INFLIGHT, on_error=None):
+        super().__init__(daemon=True, name="ingest-flusher")
+        self.write = write
+        self.on_error = on_error
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max(1, max_inflight))
+
+    def submit(self, batch: list, ids: list):
+        """Entrega un lote para escribir; bloquea mientras haya `max_inflight` lotes en vuelo."""
+        self._slots.acquire()
+        self._queue.put((batch, ids))
+
+    def run(self):
+        while True:
+            batch, ids = self._queue.get()
+            try:
+                while not self.write(batch, ids):
+                    pass
+            except Exception as e:
+                # Un error inesperado no puede matar el thread: submit() quedaría bloqueado para siempre.
+                # El lote queda sin confirmar en el stream y se reclama más adelante.
+                print(f"Error inesperado escribiendo batch de {len(batch)} eventos en segundo plano: {e}")
+                if self.on_error is not None:
+                    self.on_error(batch, ids)
+            finally:
+                self._slots.release()
@@ -1,23 +1,101 @@
-import json
+"""
+Ingest: consume los eventos de zona del stream de detecciones y los escribe
+por lotes en TimescaleDB.
+
+El stream se lee con un consumer group (XREADGROUP): cada entrada queda
+pendiente del consumidor que la leyó hasta el XACK, que se hace sólo después
+del commit del lote. Si un proceso de ingest muere con un lote en memoria, sus
+entradas siguen pendientes y otro consumidor las reclama (XAUTOCLAIM) cuando
+llevan INGEST_PENDING_IDLE_MS sin confirmar: entrega al menos una vez. Varios
+procesos (INGEST_PROCESSES o varias réplicas) pueden consumir en paralelo,
+cada uno con su lote.
+
+Si la base sigue caída después de todos los reintentos, el lote se escribe al
+journal local (ingest/journal.py) y se confirma en el stream; un thread lo
+devuelve a la base cuando vuelve. Mientras el journal tenga datos los lotes
+nuevos van directo a él, para respetar el orden y no frenar el consumo con
+reintentos que van a fallar. Sólo los errores de conexión van al journal: un
+lote que falla por sus datos queda sin confirmar en el stream.
+
+Cada lote mantiene además la tabla `zone_visits` en la misma transacción (ver
+ingest/visits.py).
+
+Con INGEST_FLUSH_MODE=async la escritura corre en un thread aparte (doble
+buffer, ver ingest/flusher.py) y los lotes salen por tamaño o por antigüedad.
+"""
+import multiprocessing
 import os
+import socket
 import time
 from typing import List, Tuple
 
 import redis
-from psycopg2.extras import execute_values
 from psycopg2 import OperationalError, InterfaceError
 
+from ingest.bulk import WRITERS
+from ingest.flusher import AsyncFlusher
+from ingest.journal import JOURNAL_DIR, JournalFull, JournalReplayer, SpillJournal, claim_slot
+from ingest.visits import close_timed_out, update_visits
 from shared.db import get_conn, init_pool
+from shared.events import DETECTIONS_STREAM_KEY, EVENT_FIELD, decode_event, event_key
 from shared.settings import settings
 
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", 200))
-SLEEP_SEC = float(os.getenv("LOOP_SLEEP", 0.2))
-QUEUE_KEY = os.getenv("REDIS_QUEUE", "detections_queue")
+# Con COPY los lotes grandes son baratos: el costo por fila baja al crecer el lote
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 1000))
+# "sync": se deja de leer mientras se escribe cada lote. "async": un thread escribe el lote
+# anterior mientras se llena el siguiente (ver ingest/flusher.py)
+FLUSH_MODE = os.getenv("INGEST_FLUSH_MODE", "sync").lower()
+# En modo async, un lote se escribe al llenarse o al cumplir esta antigüedad (segundos)
+MAX_BATCH_AGE = float(os.getenv("INGEST_MAX_BATCH_AGE", 1.0))
+# "copy" (COPY FROM STDIN, default) o "values" (INSERT con execute_values, el camino anterior)
+WRITE_MODE = os.getenv("INGEST_WRITE_MODE", "copy").lower()
+# Lista de la versión anterior: lo que quede en ella se migra al stream al arrancar
+LEGACY_QUEUE_KEY = os.getenv("REDIS_QUEUE", "detections_queue")
+GROUP = os.getenv("INGEST_GROUP", "ingest")
+CONSUMER = os.getenv("INGEST_CONSUMER") or f"{socket.gethostname()}-{os.getpid()}"
+# Procesos consumidores en paralelo dentro de este contenedor
+PROCESSES = int(os.getenv("INGEST_PROCESSES", 1))
+# Con el stream vacío se bloquea en XREADGROUP hasta este tiempo en lugar de dormir y volver a consultar
+BLOCK_TIMEOUT = float(os.getenv("INGEST_BLOCK_TIMEOUT", 1.0))
+# Entradas sin confirmar por más de este tiempo se consideran de un consumidor caído y se reclaman.
+# Tiene que superar holgadamente lo que tarda un lote con todos sus reintentos.
+PENDING_IDLE_MS = int(os.getenv("INGEST_PENDING_IDLE_MS", 300000))
+RECLAIM_INTERVAL = float(os.getenv("INGEST_RECLAIM_INTERVAL", 30.0))
+# Consumidores sin pendientes e inactivos por más de esto se borran del grupo
+DEAD_CONSUMER_IDLE_MS = int(os.getenv("INGEST_DEAD_CONSUMER_IDLE_MS", 3600000))
+# Cada cuántos segundos se cierran por timeout las visitas abiertas de más del ghost timeout de su zona
+VISIT_TIMEOUT_INTERVAL = float(os.getenv("INGEST_VISIT_TIMEOUT_INTERVAL", 60.0))
+# Métricas de journal y replay en Redis (hash ingest:stats:{consumidor}) cada tantos segundos
+STATS_INTERVAL = float(os.getenv("INGEST_STATS_INTERVAL", 30.0))
 MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", 5))
 RETRY_DELAY = float(os.getenv("DB_RETRY_DELAY", 2.0))
 
-redis_client = redis.from_url(settings.redis_url.unicode_string(), decode_responses=True)
-init_pool()
+# Sin decode_responses: los eventos pueden venir en msgpack (binario) además de JSON
+redis_client = redis.from_url(settings.redis_url.unicode_string())
+
+if WRITE_MODE not in WRITERS:
+    raise RuntimeError(f"INGEST_WRITE_MODE debe ser uno de {list(WRITERS)}, no '{WRITE_MODE}'")
+write_rows = WRITERS[WRITE_MODE]
+if FLUSH_MODE not in ("sync", "async"):
+    raise RuntimeError(f"INGEST_FLUSH_MODE debe ser 'sync' o 'async', no '{FLUSH_MODE}'")
+_event_field = EVENT_FIELD.encode()
+
+
+def _pool_exhausted(e: Exception) -> bool:
+    error_msg = str(e).lower()
+    return "pool" in error_msg and ("exhausted" in error_msg or "timeout" in error_msg)
+
+
+def _transient(e: Exception) -> bool:
+    """Errores de conexión o de pool, que se resuelven cuando la base vuelve. Los demás (DataError, IntegrityError, ...) no."""
+    return isinstance(e, (OperationalError, InterfaceError)) or _pool_exhausted(e)
+
+
+def _write(cur, batch: List[Tuple]) -> int:
+    """Eventos y visitas en la misma transacción: zone_visits nunca queda adelantada ni atrasada respecto de zone_events."""
+    inserted = write_rows(cur, batch)
+    update_visits(cur, batch)
+    return inserted
 
 
 def _flush_batch(batch: List[Tuple]):
@@ -29,15 +107,11 @@ def _flush_batch(batch: List[Tuple]):
         try:
             with get_conn() as conn:
                 with conn.cursor() as cur:
-                    execute_values(cur,
-                        """
-                        INSERT INTO zone_events (tenant_id, camera_id, zone_id, track_id, event, ts, dwell_seconds)
-                        VALUES %s
-                        """,
-                        batch
-                    )
+                    inserted = _write(cur, batch)
                 conn.commit()
             # Si llegamos aquí, el commit fue exitoso
+            if inserted < len(batch):
+                print(f"{len(batch) - inserted} eventos duplicados descartados de un batch de {len(batch)}")
             return
             
         except (OperationalError, InterfaceError) as e:
@@ -52,14 +126,13 @@ def _flush_batch(batch: List[Tuple]):
             else:
                 # Si todos los reintentos fallan, registrar el error pero no perder el batch
                 print(f"ERROR CRÍTICO: No se pudo escribir batch después de {MAX_RETRIES} intentos.")
-                print(f"Batch perdido contiene {len(batch)} eventos")
-                # Podrías implementar aquí un mecanismo de fallback (ej: escribir a un archivo)
+                print(f"Batch pendiente contiene {len(batch)} eventos")
+                # El llamador lo pasa al journal local o lo deja sin confirmar en el stream
                 raise
                 
         except Exception as e:
             # Manejar otros errores, incluyendo pool agotado
-            error_msg = str(e).lower()
-            if "pool" in error_msg and ("exhausted" in error_msg or "timeout" in error_msg):
+            if _pool_exhausted(e):
                 print(f"Pool de conexiones agotado (intento {attempt + 1}/{MAX_RETRIES}): {e}")
                 
                 if attempt < MAX_RETRIES - 1:
@@ -78,64 +151,315 @@ def _flush_batch(batch: List[Tuple]):
                 raise
 
 
-def main():
-    batch: List[Tuple] = []
-    consecutive_errors = 0
-    max_consecutive_errors = 10
-    
+def _write_once(batch: List[Tuple]):
+    """Un único intento de escritura, sin reintentos: lo usa el replayer del journal, que maneja su propio backoff."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _write(cur, batch)
+        conn.commit()
+
+
+def _close_timed_out_visits():
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                closed = close_timed_out(cur)
+            conn.commit()
+        if closed:
+            print(f"{closed} visitas cerradas por ghost timeout")
+    except Exception as e:
+        print(f"Error al cerrar visitas por timeout: {e}")
+
+
+def _event_row(item) -> Tuple:
+    d = decode_event(item)
+    # Eventos de workers anteriores no traen clave: se deriva del ts, que es igual de determinístico
+    key = d.get("event_key") or event_key(d["camera_id"], d["track_id"], d["zone_id"], d["event"], d["ts"])
+    return (
+        d.get("tenant_id", 1),
+        d["camera_id"],
+        d["zone_id"],
+        d["track_id"],
+        d["event"],
+        d["ts"],
+        d.get("dwell"),
+        key
+    )
+
+
+def _ensure_group():
+    """Crea el stream y el consumer group si no existen. El grupo arranca desde el principio del stream."""
+    try:
+        redis_client.xgroup_create(DETECTIONS_STREAM_KEY, GROUP, id="0", mkstream=True)
+        print(f"Consumer group '{GROUP}' creado en {DETECTIONS_STREAM_KEY}")
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _migrate_legacy_queue(chunk: int = 1000):
+    """Pasa al stream los eventos que hayan quedado en la lista de la versión anterior."""
+    moved = 0
     while True:
-        item = redis_client.lpop(QUEUE_KEY)
-        if item:
-            try:
-                d = json.loads(item)
-                dwell = d.get("dwell")
-                batch.append((
-                    d.get("tenant_id", 1),
-                    d["camera_id"],
-                    d["zone_id"],
-                    d["track_id"],
-                    d["event"],
-                    d["ts"],
-                    dwell
-                ))
-            except Exception as e:
-                print(f"Error al parsear item de Redis: {e}")
-                continue
-            
-            if len(batch) >= BATCH_SIZE:
+        items = redis_client.lrange(LEGACY_QUEUE_KEY, 0, chunk - 1)
+        if not items:
+            break
+        pipe = redis_client.pipeline()
+        for item in items:
+            pipe.xadd(DETECTIONS_STREAM_KEY, {EVENT_FIELD: item})
+        pipe.ltrim(LEGACY_QUEUE_KEY, len(items), -1)
+        pipe.execute()
+        moved += len(items)
+    if moved:
+        print(f"Migrados {moved} eventos de {LEGACY_QUEUE_KEY} a {DETECTIONS_STREAM_KEY}")
+
+
+def _reclaim(consumer: str, count: int) -> list:
+    """
+    Toma las entradas pendientes de otros consumidores que llevan más de
+    PENDING_IDLE_MS sin confirmar, y borra del grupo a los consumidores muertos
+    que ya no tienen pendientes.
+    """
+    claimed = []
+    start = "0-0"
+    while len(claimed) < count:
+        start, entries, *_ = redis_client.xautoclaim(
+            DETECTIONS_STREAM_KEY, GROUP, consumer, PENDING_IDLE_MS, start_id=start, count=count - len(claimed)
+        )
+        claimed.extend(entries)
+        if start in (b"0-0", "0-0"):
+            break
+    if claimed:
+        print(f"Reclamados {len(claimed)} eventos pendientes de consumidores caídos")
+
+    for info in redis_client.xinfo_consumers(DETECTIONS_STREAM_KEY, GROUP):
+        name = info["name"].decode() if isinstance(info["name"], bytes) else info["name"]
+        if name != consumer and info["pending"] == 0 and info["idle"] > DEAD_CONSUMER_IDLE_MS:
+            redis_client.xgroup_delconsumer(DETECTIONS_STREAM_KEY, GROUP, name)
+    return claimed
+
+
+def _read(consumer: str, count: int, block_ms=None) -> list:
+    """Entradas nuevas del grupo (nunca entregadas a nadie), hasta `count`."""
+    response = redis_client.xreadgroup(GROUP, consumer, {DETECTIONS_STREAM_KEY: ">"}, count=count, block=block_ms)
+    return response[0][1] if response else []
+
+
+def _ack(ids: list):
+    if ids:
+        redis_client.xack(DETECTIONS_STREAM_KEY, GROUP, *ids)
+
+
+def stats_key(consumer: str) -> str:
+    return f"ingest:stats:{consumer}"
+
+
+def _report(consumer: str, journal: SpillJournal, replayer: JournalReplayer):
+    rate = replayer.replay_rate()
+    stats = {
+        "journal_bytes": journal.size_bytes,
+        "journal_segments": journal.segment_count(),
+        "spilled_batches": journal.spilled_batches,
+        "spilled_rows": journal.spilled_rows,
+        "replayed_rows": replayer.replayed_rows,
+        "replay_rows_per_s": round(rate, 1),
+    }
+    if journal.size_bytes or rate:
+        print(f"Journal: {stats['journal_bytes'] / 1e6:.1f} MB en {stats['journal_segments']} segmentos, "
+              f"replay {rate:.0f} filas/s ({replayer.replayed_rows} devueltas)")
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(stats_key(consumer), mapping=stats)
+        pipe.expire(stats_key(consumer), int(STATS_INTERVAL * 10))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error al publicar métricas de ingest: {e}")
+
+
+class BatchSink:
+    """
+    Escribe un lote a la base (o al journal si la base no responde) y después
+    lo confirma en el stream. Lo usan tanto el flush síncrono como el thread
+    de AsyncFlusher.
+
+    `write` devuelve False si hay que reintentar el mismo lote (base caída y
+    journal lleno o deshabilitado). Un error que no es de conexión se propaga:
+    ni reintentar ni el journal lo arreglan, y el lote queda sin confirmar.
+    """
+
+    max_consecutive_errors = 10
+
+    def __init__(self, journal, seen: set):
+        self.journal = journal
+        self.seen = seen
+        self.consecutive_errors = 0
+
+    def write(self, batch: List[Tuple], ids: list) -> bool:
+        journal = self.journal
+        try:
+            if journal is not None and journal.size_bytes:
+                journal.append(batch)
+            else:
                 try:
                     _flush_batch(batch)
-                    batch = []
-                    consecutive_errors = 0  # Resetear contador de errores
                 except Exception as e:
-                    consecutive_errors += 1
-                    print(f"Error al escribir batch: {e}")
-                    
-                    if consecutive_errors >= max_consecutive_errors:
-                        print(f"Demasiados errores consecutivos ({consecutive_errors}). Esperando más tiempo antes de reintentar...")
-                        time.sleep(10)  # Esperar más tiempo si hay muchos errores
-                        consecutive_errors = 0
-                    else:
-                        # Mantener el batch para reintentar más tarde
-                        time.sleep(1)
+                    if journal is None or not _transient(e):
+                        raise
+                    print(f"Pasando el batch al journal local ({len(batch)} eventos): {e}")
+                    journal.append(batch)
+        except Exception as e:
+            if not (_transient(e) or isinstance(e, (JournalFull, OSError))):
+                raise
+            self.consecutive_errors += 1
+            print(f"Error al escribir batch: {e}")
+            # El lote queda sin confirmar (base caída y journal lleno o deshabilitado): se
+            # reintenta en el próximo ciclo y, si este proceso muere, otro consumidor lo reclama
+            if self.consecutive_errors >= self.max_consecutive_errors:
+                print(f"Demasiados errores consecutivos ({self.consecutive_errors}). Esperando más tiempo antes de reintentar...")
+                time.sleep(10)
+                self.consecutive_errors = 0
+            else:
+                time.sleep(1)
+            return False
+        try:
+            _ack(ids)
+        except redis.RedisError as e:
+            # El lote ya está escrito: sin el XACK lo vuelve a entregar XAUTOCLAIM y
+            # ON CONFLICT descarta los duplicados, así que no se reintenta la escritura
+            print(f"Error al confirmar {len(ids)} eventos en Redis (se reentregarán): {e}")
+        self.seen.difference_update(ids)
+        self.consecutive_errors = 0
+        return True
+
+    def abandon(self, batch: List[Tuple], ids: list):
+        """Lote que no se va a escribir desde acá: sus ids dejan de estar en vuelo para que el reclamo los tome."""
+        self.seen.difference_update(ids)
+
+
+def consume(consumer: str = CONSUMER):
+    """
+    Bucle de un consumidor: lee del grupo, escribe por lotes y confirma después
+    del commit (o de pasar el lote al journal).
+    """
+    journal = replayer = None
+    if JOURNAL_DIR:
+        # El lock se mantiene abierto mientras viva el proceso: ninguna otra réplica usa este slot
+        journal_dir, _journal_lock = claim_slot(JOURNAL_DIR)
+        journal = SpillJournal(journal_dir)
+        replayer = JournalReplayer(journal, _write_once, _transient)
+        replayer.start()
+    last_stats = time.monotonic()
+
+    batch: List[Tuple] = []
+    ids: list = []  # ids del stream de las filas de `batch`, en el mismo orden
+    batch_t0 = 0.0  # cuándo entró la primera fila del lote actual
+    # ids leídos y todavía sin confirmar (lote actual y lotes en vuelo), para no duplicar lo que se reclame
+    seen = set()
+    sink = BatchSink(journal, seen)
+    flusher = None
+    if FLUSH_MODE == "async":
+        flusher = AsyncFlusher(sink.write, on_error=sink.abandon)
+        flusher.start()
+    last_reclaim = 0.0
+    last_visit_timeout = 0.0
+    print(f"Ingest: consumidor '{consumer}' en el grupo '{GROUP}' de {DETECTIONS_STREAM_KEY} (flush {FLUSH_MODE})")
+
+    def add(entries):
+        nonlocal batch_t0
+        if entries and not batch:
+            batch_t0 = time.monotonic()
+        invalid = []
+        for entry_id, fields in entries:
+            if entry_id in seen:
+                continue
+            try:
+                # Entradas recortadas por MAXLEN antes del reclamo llegan sin campos
+                batch.append(_event_row(fields[_event_field]))
+                ids.append(entry_id)
+                seen.add(entry_id)
+            except Exception as e:
+                print(f"Error al parsear evento {entry_id}: {e}")
+                invalid.append(entry_id)
+        # Un evento que no se puede parsear no se va a poder parsear nunca: se confirma y se descarta
+        _ack(invalid)
+
+    def flush() -> bool:
+        nonlocal batch, ids
+        if flusher is not None:
+            # Doble buffer: el lote pasa al thread de escritura y se empieza uno nuevo
+            flusher.submit(batch, ids)
         else:
-            if batch:
-                try:
-                    _flush_batch(batch)
-                    batch = []
-                    consecutive_errors = 0
-                except Exception as e:
-                    consecutive_errors += 1
-                    print(f"Error al escribir batch final: {e}")
-                    
-                    if consecutive_errors >= max_consecutive_errors:
-                        print(f"Demasiados errores consecutivos ({consecutive_errors}). Esperando más tiempo...")
-                        time.sleep(10)
-                        consecutive_errors = 0
-                    else:
-                        time.sleep(1)
-                        continue  # Mantener el batch para el siguiente ciclo
-            time.sleep(SLEEP_SEC)
+            try:
+                if not sink.write(batch, ids):
+                    return False
+            except Exception as e:
+                # Mismo criterio que AsyncFlusher: el lote queda sin confirmar y se reclama más adelante
+                print(f"Error al escribir batch de {len(batch)} eventos, queda sin confirmar: {e}")
+                sink.abandon(batch, ids)
+        batch, ids = [], []
+        return True
+
+    while True:
+        if journal is not None and time.monotonic() - last_stats >= STATS_INTERVAL:
+            last_stats = time.monotonic()
+            _report(consumer, journal, replayer)
+        if time.monotonic() - last_visit_timeout >= VISIT_TIMEOUT_INTERVAL:
+            last_visit_timeout = time.monotonic()
+            _close_timed_out_visits()
+
+        # Lote lleno (o un flush anterior que falló): escribir antes de leer más
+        if len(batch) >= BATCH_SIZE and not flush():
+            continue
+        # En modo async también se escribe por antigüedad, así con poco tráfico la latencia queda acotada
+        age = time.monotonic() - batch_t0
+        if flusher is not None and batch and age >= MAX_BATCH_AGE:
+            flush()
+            continue
+        room = BATCH_SIZE - len(batch)
+        now = time.monotonic()
+        if now - last_reclaim >= RECLAIM_INTERVAL:
+            last_reclaim = now
+            try:
+                add(_reclaim(consumer, room))
+            except redis.ResponseError as e:
+                print(f"Error al reclamar pendientes: {e}")
+            room = max(1, BATCH_SIZE - len(batch))
+
+        if flusher is not None:
+            # Bloquear a lo sumo hasta el vencimiento del lote actual
+            wait = min(BLOCK_TIMEOUT, MAX_BATCH_AGE - age) if batch else BLOCK_TIMEOUT
+            add(_read(consumer, room, block_ms=max(1, int(wait * 1000))))
+            continue
+
+        entries = _read(consumer, room)
+        if not entries:
+            # Stream vacío: escribir lo pendiente y esperar bloqueado a la próxima entrada
+            if batch and not flush():
+                continue  # Mantener el batch para el siguiente ciclo
+            entries = _read(consumer, max(1, BATCH_SIZE - len(batch)), block_ms=int(BLOCK_TIMEOUT * 1000))
+        add(entries)
+
+
+def main():
+    _ensure_group()
+    _migrate_legacy_queue()
+    if PROCESSES <= 1:
+        consume()
+        return
+
+    # Cada proceso es un consumidor independiente del grupo, con su propio lote y pool de conexiones
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=consume, args=(f"{CONSUMER}-{i}",), daemon=True) for i in range(PROCESSES)]
+    for proc in procs:
+        proc.start()
+    while all(proc.is_alive() for proc in procs):
+        time.sleep(5)
+    # Si un consumidor muere se termina el contenedor para que lo reinicie el orquestador;
+    # sus pendientes los reclaman los demás consumidores
+    for proc in procs:
+        if proc.is_alive():
+            proc.terminate()
+    raise SystemExit("Ingest: un proceso consumidor terminó inesperadamente")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+"""
+Journal local de ingest para caídas de la base de datos.
+
+Cuando un lote no se puede escribir después de todos los reintentos, se agrega
+al journal en disco en lugar de quedar en memoria: un directorio de segmentos
+append-only (`000000000001.jsonl`, ...), un lote por línea, que rotan al pasar
+INGEST_JOURNAL_SEGMENT_MB. El uso de disco está acotado por INGEST_JOURNAL_MAX_MB:
+con el journal lleno `append` lanza JournalFull y el lote queda sin confirmar en
+el stream de Redis, que hace de siguiente nivel de respaldo.
+
+`JournalReplayer` corre en un thread y devuelve el journal a la base en orden,
+segmento por segmento y lote por lote con COPY, en cuanto la base responde. El
+avance dentro del segmento se guarda en `<segmento>.offset` después de cada
+commit, así que un reinicio no repite lotes ya escritos. Un segmento que falla
+con un error que no es de conexión (datos inválidos, constraint) no se
+reintenta: se aparta a `quarantine/` y el replay sigue con el siguiente.
+
+Cada proceso de ingest usa su propio directorio `slot_N` dentro de
+INGEST_JOURNAL_DIR, reservado con un flock (`claim_slot`): réplicas que montan
+el mismo volumen no se pisan, y la que arranca después de una caída retoma el
+journal que quedó.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+
+JOURNAL_DIR = os.getenv("INGEST_JOURNAL_DIR", "ingest_journal")
+JOURNAL_SEGMENT_BYTES = int(float(os.getenv("INGEST_JOURNAL_SEGMENT_MB", 64)) * 1024 * 1024)
+JOURNAL_MAX_BYTES = int(float(os.getenv("INGEST_JOURNAL_MAX_MB", 2048)) * 1024 * 1024)
+# Espera máxima entre intentos del replayer mientras la base sigue caída
+REPLAY_MAX_BACKOFF = float(os.getenv("INGEST_JOURNAL_MAX_BACKOFF", 30.0))
+
+SEGMENT_SUFFIX = ".jsonl"
+OFFSET_SUFFIX = ".offset"
+QUARANTINE_DIR = "quarantine"
+
+
+class JournalFull(Exception):
+    pass
+
+
+def claim_slot(base: str = JOURNAL_DIR):
+    """
+    Reserva el primer `base/slot_N` que no esté tomado por otro proceso.
+    Devuelve (directorio, archivo de lock); el lock dura mientras el archivo
+    siga abierto, así que hay que conservarlo mientras se use el journal.
+    """
+    n = 0
+    while True:
+        directory = os.path.join(base, f"slot_{n}")
+        os.makedirs(directory, exist_ok=True)
+        lock = open(os.path.join(directory, ".lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return directory, lock
+        except BlockingIOError:
+            lock.close()
+            n += 1
+
+
+class SpillJournal:
+    def __init__(self, directory: str = JOURNAL_DIR, segment_bytes: int = JOURNAL_SEGMENT_BYTES,
+                 max_bytes: int = JOURNAL_MAX_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Lo que haya de una corrida anterior queda cerrado para replay; se escribe siempre en un segmento nuevo
+        segments = self._segments()
+        self._sealed = segments
+        self._current = None
+        self._next_number = (int(os.path.basename(segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1) if segments else 1
+        self._file = None
+        self.size_bytes = sum(os.path.getsize(path) for path in segments)
+        self.spilled_batches = 0
+        self.spilled_rows = 0
+        if segments:
+            print(f"Journal: {len(segments)} segmentos pendientes ({self.size_bytes / 1e6:.1f} MB) en {directory}")
+
+    def _segments(self) -> list:
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _rotate(self):
+        """Cierra el segmento actual y pasa a uno nuevo. Se llama con el lock tomado."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._current is not None and os.path.exists(self._current):
+            self._sealed.append(self._current)
+        self._current = os.path.join(self.directory, f"{self._next_number:012d}{SEGMENT_SUFFIX}")
+        self._next_number += 1
+
+    def append(self, rows: list):
+        """Agrega un lote al segmento actual y hace fsync antes de volver: al retornar el lote está en disco."""
+        line = (json.dumps(rows, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            if self.size_bytes + len(line) > self.max_bytes:
+                raise JournalFull(f"journal lleno ({self.size_bytes / 1e6:.1f} MB de {self.max_bytes / 1e6:.0f} MB)")
+            if self._current is None:
+                self._rotate()
+            if self._file is None:
+                self._file = open(self._current, "ab")
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.size_bytes += len(line)
+            self.spilled_batches += 1
+            self.spilled_rows += len(rows)
+            if self._file.tell() >= self.segment_bytes:
+                self._rotate()
+
+    def oldest_segment(self):
+        """El segmento más viejo listo para replay; si sólo queda el actual, se cierra para liberarlo."""
+        with self._lock:
+            if not self._sealed and self._current is not None and os.path.exists(self._current) \
+                    and os.path.getsize(self._current) > 0:
+                self._rotate()
+            return self._sealed[0] if self._sealed else None
+
+    def read_segment(self, path: str):
+        """Itera (offset_siguiente, filas) desde el último offset confirmado del segmento."""
+        offset = 0
+        if os.path.exists(path + OFFSET_SUFFIX):
+            with open(path + OFFSET_SUFFIX) as f:
+                offset = int(f.read().strip() or 0)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if not line.endswith(b"\n"):
+                    # Línea cortada por una caída a mitad de escritura: nunca se confirmó
+                    break
+                yield offset, [tuple(row) for row in json.loads(line)]
+
+    def commit_offset(self, path: str, offset: int):
+        tmp = path + OFFSET_SUFFIX + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+        os.replace(tmp, path + OFFSET_SUFFIX)
+
+    def remove_segment(self, path: str):
+        with self._lock:
+            self.size_bytes = max(0, self.size_bytes - os.path.getsize(path))
+            self._sealed.remove(path)
+            os.remove(path)
+            if os.path.exists(path + OFFSET_SUFFIX):
+                os.remove(path + OFFSET_SUFFIX)
+
+    def quarantine_segment(self, path: str) -> str:
+        """Saca el segmento (y su offset) del replay moviéndolo a `quarantine/`. Devuelve el destino."""
+        target_dir = os.path.join(self.directory, QUARANTINE_DIR)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, os.path.basename(path))
+        with self._lock:
+            self.size_bytes = max(0, self.size_bytes - os.path.getsize(path))
+            self._sealed.remove(path)
+            os.replace(path, target)
+            if os.path.exists(path + OFFSET_SUFFIX):
+                os.replace(path + OFFSET_SUFFIX, target + OFFSET_SUFFIX)
+        return target
+
+    def segment_count(self) -> int:
+        with self._lock:
+            return len(self._sealed) + (1 if self._file is not None else 0)
+
+
+class JournalReplayer(threading.Thread):
+    """
+    Devuelve el journal a la base con `write_batch(rows)` (un intento, que lanza
+    si falla). Mientras la base no responde (`is_transient(error)`) reintenta con
+    backoff exponencial; cualquier otro error aparta el segmento.
+    """
+
+    def __init__(self, journal: SpillJournal, write_batch, is_transient, idle_sleep: float = 1.0):
+        super().__init__(daemon=True, name="journal-replayer")
+        self.journal = journal
+        self.write_batch = write_batch
+        self.is_transient = is_transient
+        self.idle_sleep = idle_sleep
+        self.replayed_rows = 0
+        self.replayed_batches = 0
+        self._rate_rows = 0
+        self._rate_t0 = time.time()
+        self._backoff = 1.0
+
+    def replay_rate(self) -> float:
+        """Filas/s devueltas a la base desde la última llamada."""
+        now = time.time()
+        rate = self._rate_rows / max(now - self._rate_t0, 1e-6)
+        self._rate_rows, self._rate_t0 = 0, now
+        return rate
+
+    def run(self):
+        while True:
+            path = self.journal.oldest_segment()
+            if path is None:
+                time.sleep(self.idle_sleep)
+                continue
+            try:
+                self._replay_segment(path)
+                self._backoff = 1.0
+            except Exception as e:
+                if not self.is_transient(e):
+                    # Reintentar no lo arregla, y mientras tanto el journal no se vacía
+                    target = self.journal.quarantine_segment(path)
+                    print(f"Journal: el segmento {os.path.basename(path)} falló con un error que no es de conexión "
+                          f"({e}); se apartó a {target} para revisarlo a mano")
+                    continue
+                print(f"Journal: replay pausado, la base sigue sin responder ({e}). Reintento en {self._backoff:.0f}s")
+                time.sleep(self._backoff)
+                self._backoff = min(self._backoff * 2, REPLAY_MAX_BACKOFF)
+
+    def _replay_segment(self, path: str):
+        for offset, rows in self.journal.read_segment(path):
+            self.write_batch(rows)
+            self.journal.commit_offset(path, offset)
+            self.replayed_batches += 1
+            self.replayed_rows += len(rows)
+            self._rate_rows += len(rows)
+        self.journal.remove_segment(path)
+        print(f"Journal: segmento {os.path.basename(path)} devuelto a la base ({self.replayed_rows} filas en total)")
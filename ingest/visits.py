@@ -0,0 +1,125 @@
+"""
+Mantenimiento de `zone_visits`: una fila por visita (enter_ts, exit_ts, dwell),
+armada por ingest en la misma transacción que escribe los eventos.
+
+Por cada lote:
+1. Cada `enter` abre una visita (idempotente por la clave primaria).
+2. Cada `exit` cierra la visita abierta más reciente del mismo track en la
+   zona, siempre que haya empezado dentro del ghost_timeout_minutes de la zona:
+   los track_id se reutilizan después de un reset del tracker, y sin esa cota
+   se emparejarían visitas de personas distintas.
+3. Las visitas abiertas en este lote cuyo `exit` ya estaba en zone_events (lo
+   escribió antes otro consumidor en paralelo) se cierran con ese exit.
+
+`close_timed_out` cierra como 'timeout' las visitas que siguen abiertas pasado
+el ghost timeout de su zona, con exit_ts = enter_ts + timeout (el mismo
+criterio de ocupación del API) y dwell NULL, porque no se sabe cuándo salió.
+
+`update_visits` toma un advisory lock de transacción por cada (cámara, zona)
+del lote, en orden para no generar deadlocks: los consumidores en paralelo que
+tocan la misma zona ven siempre lo que el otro ya commiteó y no se pisan, y los
+que escriben zonas distintas no se esperan. `close_timed_out` no lo necesita:
+sólo toca visitas abiertas, y un exit que llega después corrige el cierre.
+"""
+from psycopg2.extras import execute_values
+
+# Default de config_loader para zonas sin ghost_timeout_minutes
+DEFAULT_GHOST_TIMEOUT_MINUTES = 60
+
+
+def _timeout(zone_id_column: str) -> str:
+    """Expresión SQL con el ghost timeout de la zona como INTERVAL."""
+    return (f"COALESCE((SELECT z.ghost_timeout_minutes FROM zones z WHERE z.id = {zone_id_column}), "
+            f"{DEFAULT_GHOST_TIMEOUT_MINUTES}) * INTERVAL '1 minute'")
+
+
+def _exit_used(alias: str) -> str:
+    """Condición SQL: el exit `alias` ya cerró otra visita, así que no se reutiliza (replays idempotentes)."""
+    return f"""EXISTS (
+          SELECT 1 FROM zone_visits u
+          WHERE u.camera_id = {alias}.camera_id AND u.zone_id = {alias}.zone_id AND u.track_id = {alias}.track_id
+            AND u.enter_ts <= {alias}.ts AND u.exit_ts = {alias}.ts AND u.closed_by = 'exit'
+      )"""
+
+
+OPEN_VISITS_SQL = """
+INSERT INTO zone_visits (tenant_id, camera_id, zone_id, track_id, enter_ts, enter_key)
+VALUES %s
+ON CONFLICT DO NOTHING
+"""
+
+CLOSE_BY_EXIT_SQL = f"""
+UPDATE zone_visits v
+SET exit_ts = m.ts, dwell_seconds = EXTRACT(EPOCH FROM (m.ts - v.enter_ts)), closed_by = 'exit'
+FROM (
+    SELECT DISTINCT ON (o.camera_id, o.zone_id, o.track_id, o.enter_ts)
+           o.camera_id, o.zone_id, o.track_id, o.enter_ts, x.ts
+    FROM (VALUES %s) AS x(camera_id, zone_id, track_id, ts)
+    CROSS JOIN LATERAL (
+        SELECT ov.camera_id, ov.zone_id, ov.track_id, ov.enter_ts
+        FROM zone_visits ov
+        WHERE ov.camera_id = x.camera_id AND ov.zone_id = x.zone_id AND ov.track_id = x.track_id
+          AND ov.enter_ts <= x.ts AND ov.enter_ts > x.ts - {_timeout("x.zone_id")}
+          -- Un exit que llega tarde (journal, reintentos) corrige un cierre por timeout
+          AND (ov.exit_ts IS NULL OR ov.closed_by = 'timeout')
+        ORDER BY ov.enter_ts DESC
+        LIMIT 1
+    ) o
+    WHERE NOT {_exit_used("x")}
+    ORDER BY o.camera_id, o.zone_id, o.track_id, o.enter_ts, x.ts
+) m
+WHERE v.camera_id = m.camera_id AND v.zone_id = m.zone_id AND v.track_id = m.track_id AND v.enter_ts = m.enter_ts
+"""
+
+CLOSE_FROM_EVENTS_SQL = f"""
+UPDATE zone_visits v
+SET exit_ts = x.ts, dwell_seconds = EXTRACT(EPOCH FROM (x.ts - v.enter_ts)), closed_by = 'exit'
+FROM (VALUES %s) AS b(camera_id, zone_id, track_id, enter_ts)
+CROSS JOIN LATERAL (
+    SELECT e.ts
+    FROM zone_events e
+    WHERE e.zone_id = b.zone_id AND e.track_id = b.track_id AND e.camera_id = b.camera_id AND e.event = 'exit'
+      AND e.ts >= b.enter_ts AND e.ts < b.enter_ts + {_timeout("b.zone_id")}
+      AND NOT {_exit_used("e")}
+    ORDER BY e.ts
+    LIMIT 1
+) x
+WHERE v.camera_id = b.camera_id AND v.zone_id = b.zone_id AND v.track_id = b.track_id
+  AND v.enter_ts = b.enter_ts AND v.exit_ts IS NULL
+"""
+
+CLOSE_TIMED_OUT_SQL = f"""
+UPDATE zone_visits v
+SET exit_ts = v.enter_ts + {_timeout("v.zone_id")}, closed_by = 'timeout'
+WHERE v.exit_ts IS NULL AND v.enter_ts < NOW() - {_timeout("v.zone_id")}
+"""
+
+
+def _lock(cur, zones):
+    """Un lock por (cámara, zona) en un solo round trip, siempre en el mismo orden (el del array)."""
+    keys = sorted(f"zone_visits:{camera_id}:{zone_id}" for camera_id, zone_id in zones)
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(%s::text[]) AS k", (keys,))
+
+
+def update_visits(cur, rows):
+    """Abre y cierra visitas a partir de filas de eventos (ver ingest.bulk.EVENT_COLUMNS). No hace commit."""
+    enters = [(r[0], r[1], r[2], r[3], r[5], r[7]) for r in rows if r[4] == "enter"]
+    exits = [(r[1], r[2], r[3], r[5]) for r in rows if r[4] == "exit"]
+    if not enters and not exits:
+        return
+    _lock(cur, {(e[1], e[2]) for e in enters} | {(x[0], x[1]) for x in exits})
+    if enters:
+        execute_values(cur, OPEN_VISITS_SQL, enters, template="(%s, %s, %s, %s, %s::timestamptz, %s::uuid)",
+                       page_size=len(enters))
+    if exits:
+        execute_values(cur, CLOSE_BY_EXIT_SQL, exits, template="(%s, %s, %s, %s::timestamptz)",
+                       page_size=len(exits))
+    if enters:
+        execute_values(cur, CLOSE_FROM_EVENTS_SQL, [e[1:5] for e in enters],
+                       template="(%s, %s, %s, %s::timestamptz)", page_size=len(enters))
+
+
+def close_timed_out(cur) -> int:
+    """Cierra por timeout las visitas abiertas de más del ghost timeout de su zona. Devuelve cuántas. No hace commit."""
+    cur.execute(CLOSE_TIMED_OUT_SQL)
+    return cur.rowcount
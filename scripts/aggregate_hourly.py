@@ -6,20 +6,18 @@ from psycopg2.extras import DictCursor
 from shared.db import get_conn
 
 
-# ESTA ES UNA CONSULTA SQL COMPLETAMENTE REVISADA Y MEJORADA.
-# Aborda los problemas de la versión anterior:
+# Agregación por hora sobre `zone_visits` (una fila por visita, mantenida por ingest):
 # 1. CÁLCULO DE OCUPACIÓN:
-#    - Primero obtiene la ocupación final de la hora ANTERIOR ('starting_occupancy') para usarla como base.
-#    - Luego crea una línea de tiempo detallada de todos los eventos 'enter' y 'exit' DENTRO de la hora actual.
-#    - Calcula la ocupación en cada punto de tiempo sumando o restando de la ocupación inicial.
-#    - Calcula el promedio de ocupación ponderado por el tiempo que duró cada estado de ocupación.
+#    - La ocupación al inicio de la hora son las visitas que empezaron antes y terminan después.
+#    - Cada visita suma 1 al entrar y resta 1 al terminar (exit o ghost timeout) dentro de la hora.
+#    - Se promedia la ocupación ponderada por el tiempo que duró cada estado.
 # 2. CÁLCULO DEL TIEMPO DE PERMANENCIA:
-#    - Identifica todos los eventos 'enter' en la hora actual o antes, para pistas que todavía estaban dentro.
-#    - Busca el correspondiente evento 'exit' INCLUSO SI OCURRE DESPUÉS de la hora actual.
-#    - Esto captura correctamente los tiempos de permanencia que cruzan los límites de la hora.
-#    - Limita el tiempo de permanencia contado a la hora actual para no contaminar las métricas de otras horas.
+#    - Visitas cerradas por un exit que se solapan con la hora, aunque hayan empezado antes o
+#      terminado después, con la permanencia recortada a la hora.
 # 3. CONTEO DE ENTRADAS:
-#    - Sigue siendo un simple recuento de eventos 'enter' dentro de la hora, ahora útil para medir "movimiento".
+#    - Visitas que empezaron dentro de la hora.
+# Ninguna visita dura más que el ghost timeout de su zona, así que todo es un range scan sobre
+# enter_ts en [inicio - timeout máximo, fin), sin recorrer el historial ni emparejar track_ids.
 AGGREGATION_QUERY = """
 WITH time_range AS (
     SELECT
@@ -29,32 +27,51 @@ WITH time_range AS (
 time_range_utc AS (
     SELECT
         start_ts_local AT TIME ZONE 'America/Guayaquil' AS start_ts_utc,
-        end_ts_local AT TIME ZONE 'America/Guayaquil' AS end_ts_utc
+        end_ts_local AT TIME ZONE 'America/Guayaquil' AS end_ts_utc,
+        (SELECT COALESCE(MAX(ghost_timeout_minutes), 60) FROM zones) * INTERVAL '1 minute' AS max_visit
     FROM time_range
 ),
+visits AS (
+    SELECT
+        v.zone_id,
+        v.enter_ts,
+        -- Visitas todavía abiertas terminan, como mucho, al vencer el ghost timeout de la zona
+        COALESCE(v.exit_ts, v.enter_ts + COALESCE(z.ghost_timeout_minutes, 60) * INTERVAL '1 minute') AS end_ts,
+        v.closed_by
+    FROM zone_visits v
+    CROSS JOIN time_range_utc tr
+    LEFT JOIN zones z ON z.id = v.zone_id
+    WHERE v.enter_ts >= tr.start_ts_utc - tr.max_visit
+      AND v.enter_ts < tr.end_ts_utc
+),
+visits_in_hour AS (
+    SELECT visits.*
+    FROM visits, time_range_utc
+    WHERE end_ts >= start_ts_utc
+),
 starting_occupancy AS (
     SELECT
         zone_id,
-        COALESCE(SUM(CASE WHEN event = 'enter' THEN 1 ELSE -1 END), 0) AS occupancy
-    FROM zone_events, time_range_utc
-    WHERE ts < start_ts_utc
+        COUNT(*) AS occupancy
+    FROM visits_in_hour, time_range_utc
+    WHERE enter_ts < start_ts_utc
     GROUP BY zone_id
 ),
-events_in_hour AS (
-    SELECT
-        ts,
-        zone_id,
-        track_id,
-        event
-    FROM zone_events, time_range_utc
-    WHERE ts >= start_ts_utc AND ts < end_ts_utc
+occupancy_deltas AS (
+    SELECT zone_id, enter_ts AS ts, 1 AS delta
+    FROM visits_in_hour, time_range_utc
+    WHERE enter_ts >= start_ts_utc
+    UNION ALL
+    SELECT zone_id, end_ts AS ts, -1 AS delta
+    FROM visits_in_hour, time_range_utc
+    WHERE end_ts < end_ts_utc
 ),
 occupancy_changes AS (
     SELECT
         zone_id,
         ts,
-        SUM(CASE WHEN event = 'enter' THEN 1 ELSE -1 END) OVER (PARTITION BY zone_id ORDER BY ts) AS net_change
-    FROM events_in_hour
+        SUM(delta) OVER (PARTITION BY zone_id ORDER BY ts) AS net_change
+    FROM occupancy_deltas
 ),
 occupancy_timeline AS (
     SELECT
@@ -77,23 +94,17 @@ entries_in_hour AS (
     SELECT
         zone_id,
         count(*) as total_entries
-    FROM events_in_hour
-    WHERE event = 'enter'
+    FROM visits_in_hour, time_range_utc
+    WHERE enter_ts >= start_ts_utc
     GROUP BY zone_id
 ),
 dwell_times AS (
     SELECT
-        e.zone_id,
-        EXTRACT(EPOCH FROM (LEAST(x.ts, (SELECT end_ts_utc FROM time_range_utc)) - GREATEST(e.ts, (SELECT start_ts_utc FROM time_range_utc)))) as dwell_seconds
-    FROM
-        zone_events e
-    JOIN
-        zone_events x ON e.track_id = x.track_id AND e.zone_id = x.zone_id
+        vh.zone_id,
+        EXTRACT(EPOCH FROM (LEAST(vh.end_ts, tr.end_ts_utc) - GREATEST(vh.enter_ts, tr.start_ts_utc))) as dwell_seconds
+    FROM visits_in_hour vh
     CROSS JOIN time_range_utc tr
-    WHERE
-        e.event = 'enter' AND x.event = 'exit'
-        AND e.ts < tr.end_ts_utc
-        AND x.ts >= tr.start_ts_utc
+    WHERE vh.closed_by = 'exit'
 ),
 final_metrics AS (
     SELECT
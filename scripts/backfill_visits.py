@@ -0,0 +1,55 @@
+"""
+Reconstruye `zone_visits` desde `zone_events` para un rango de tiempo, con el
+mismo código que usa ingest (ingest/visits.py): los eventos se recorren en
+orden de ts, en lotes, y al final se cierran por timeout las visitas que
+quedaron abiertas. Es idempotente, se puede correr de nuevo sobre el mismo rango.
+
+Uso:
+    python -m scripts.backfill_visits --since 2025-10-01T00:00:00-05:00
+    python -m scripts.backfill_visits --since 2025-10-01T00:00:00-05:00 --until 2025-10-08T00:00:00-05:00
+"""
+import argparse
+from datetime import datetime, timezone
+
+from ingest.bulk import EVENT_COLUMNS
+from ingest.visits import close_timed_out, update_visits
+from shared.db import get_conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruir zone_visits desde zone_events.")
+    parser.add_argument("--since", required=True, help="Inicio del rango (ISO 8601 con zona horaria).")
+    parser.add_argument("--until", help="Fin del rango (default: ahora).")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since)
+    until = datetime.fromisoformat(args.until) if args.until else datetime.now(timezone.utc)
+
+    total = 0
+    with get_conn() as conn:
+        # Cursor del lado del servidor para no traer todo el rango a memoria; withhold para que
+        # sobreviva al commit de cada lote, que libera los advisory locks de sus zonas y no frena a ingest
+        with conn.cursor(name="backfill_visits", withhold=True) as events:
+            events.itersize = args.batch_size
+            events.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM zone_events WHERE ts >= %s AND ts < %s AND event IN ('enter', 'exit') ORDER BY ts",
+                (since, until),
+            )
+            while True:
+                rows = events.fetchmany(args.batch_size)
+                if not rows:
+                    break
+                with conn.cursor() as cur:
+                    update_visits(cur, rows)
+                conn.commit()
+                total += len(rows)
+                print(f"{total} eventos procesados (hasta {rows[-1][EVENT_COLUMNS.index('ts')]})")
+        with conn.cursor() as cur:
+            closed = close_timed_out(cur)
+        conn.commit()
+    print(f"Backfill completado: {total} eventos, {closed} visitas cerradas por timeout.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compara los backends de inferencia del worker (torch, onnx, openvino) sobre un
+clip grabado: fps de inferencia y concordancia de detecciones de personas con
+el backend torch, que se toma como referencia.
+
+Uso:
+    python -m scripts.benchmark_backends --video clip.mp4 --backends torch,onnx,openvino --threads 4
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from worker.backend import INFERENCE_IMGSZ, MODEL_WEIGHTS, load_model
+
+
+def read_clip(path: str, max_frames: int) -> list:
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"No se pudieron leer frames de {path}")
+    return frames
+
+
+def run_backend(backend: str, frames: list, weights: str, threads: int, imgsz: int, batch: int):
+    """Devuelve (fps, [cajas xyxy de personas por frame])."""
+    model = load_model(weights, backend=backend, threads=threads, imgsz=imgsz)
+    # Calentamiento: el primer predict paga la inicialización del runtime
+    model.predict(frames[:batch], classes=[0], verbose=False)
+
+    boxes = []
+    t0 = time.time()
+    for i in range(0, len(frames), batch):
+        for result in model.predict(frames[i:i + batch], classes=[0], verbose=False):
+            boxes.append(result.boxes.xyxy.cpu().numpy())
+    return len(frames) / (time.time() - t0), boxes
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def agreement(reference: list, candidate: list, iou_threshold: float) -> dict:
+    """Recall/precisión respecto de la referencia con matching greedy por IoU, e IoU medio de los pares."""
+    matched = ref_total = cand_total = 0
+    ious = []
+    for ref, cand in zip(reference, candidate):
+        ref_total += len(ref)
+        cand_total += len(cand)
+        if not len(ref) or not len(cand):
+            continue
+        iou = iou_matrix(ref, cand)
+        while True:
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < iou_threshold:
+                break
+            matched += 1
+            ious.append(iou[i, j])
+            iou[i, :] = -1
+            iou[:, j] = -1
+    return {
+        "recall": matched / ref_total if ref_total else 1.0,
+        "precision": matched / cand_total if cand_total else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de inferencia del worker sobre un clip grabado.")
+    parser.add_argument("--video", required=True, help="Clip de video grabado de una cámara.")
+    parser.add_argument("--weights", default=MODEL_WEIGHTS)
+    parser.add_argument("--backends", default="torch,onnx,openvino",
+                        help="Lista separada por comas; el primero se usa como referencia de precisión.")
+    parser.add_argument("--frames", type=int, default=300, help="Máximo de frames a leer del clip.")
+    parser.add_argument("--threads", type=int, default=0, help="Threads de CPU (0 = default del runtime).")
+    parser.add_argument("--imgsz", type=int, default=INFERENCE_IMGSZ)
+    parser.add_argument("--batch", type=int, default=1, help="Frames por predict (el worker agrupa cámaras).")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU mínimo para considerar dos cajas la misma.")
+    args = parser.parse_args()
+
+    frames = read_clip(args.video, args.frames)
+    print(f"Clip: {len(frames)} frames de {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    reference = None
+    print(f"{'backend':<10} {'fps':>8} {'recall':>8} {'precision':>10} {'iou':>6}")
+    for backend in backends:
+        fps, boxes = run_backend(backend, frames, args.weights, args.threads, args.imgsz, args.batch)
+        if reference is None:
+            reference = boxes
+        acc = agreement(reference, boxes, args.iou)
+        print(f"{backend:<10} {fps:>8.1f} {acc['recall']:>8.3f} {acc['precision']:>10.3f} {acc['mean_iou']:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
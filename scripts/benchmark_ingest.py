@@ -0,0 +1,97 @@
+"""
+Benchmark de escritura de ingest: filas/s de execute_values contra COPY
+(ambos con deduplicación por event_key) a varios tamaños de lote, sobre una copia de `zone_events` (hypertable si la
+extensión timescaledb está disponible) en una base local. La tabla de prueba
+se borra al terminar.
+
+Uso:
+    python -m scripts.benchmark_ingest --rows 100000 --batch-sizes 200,1000,5000,20000
+    python -m scripts.benchmark_ingest --dsn postgresql://postgres@localhost:5432/vision
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+
+from ingest.bulk import WRITERS
+
+BENCH_TABLE = "zone_events_bench"
+
+
+def synthetic_rows(n: int) -> list:
+    """Eventos con la forma de los que produce el worker, espaciados en el tiempo."""
+    start = datetime.now(timezone.utc) - timedelta(hours=6)
+    rows = []
+    for i in range(n):
+        event = "enter" if i % 2 == 0 else "exit"
+        ts = (start + timedelta(milliseconds=200 * i)).isoformat()
+        rows.append((1, random.randint(1, 6), random.randint(1, 6), i // 2, event, ts,
+                     round(random.uniform(1, 600), 2) if event == "exit" else None, str(uuid.uuid4())))
+    return rows
+
+
+def create_table(conn, hypertable: bool):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cur.execute(f"CREATE TABLE {BENCH_TABLE} (LIKE zone_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)")
+        if hypertable:
+            cur.execute(f"SELECT create_hypertable('{BENCH_TABLE}', 'ts', chunk_time_interval => INTERVAL '1 hour')")
+    conn.commit()
+
+
+def run(conn, mode: str, rows: list, batch_size: int) -> float:
+    """Escribe `rows` en lotes de `batch_size`, con un commit por lote como ingest. Devuelve filas/s."""
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {BENCH_TABLE}")
+    conn.commit()
+
+    write_rows = WRITERS[mode]
+    t0 = time.time()
+    for i in range(0, len(rows), batch_size):
+        with conn.cursor() as cur:
+            write_rows(cur, rows[i:i + batch_size], table=BENCH_TABLE)
+        conn.commit()
+    return len(rows) / (time.time() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de execute_values vs COPY para ingest.")
+    parser.add_argument("--dsn", help="Cadena de conexión (default: DATABASE_URL del .env).")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-sizes", default="200,1000,5000,20000")
+    parser.add_argument("--no-hypertable", action="store_true", help="Usar una tabla normal en lugar de hypertable.")
+    args = parser.parse_args()
+
+    if args.dsn:
+        dsn = args.dsn
+    else:
+        from shared.settings import settings
+        dsn = settings.database_url.unicode_string()
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+            hypertable = cur.fetchone() is not None and not args.no_hypertable
+        create_table(conn, hypertable)
+
+        rows = synthetic_rows(args.rows)
+        print(f"{len(rows)} filas sobre {'hypertable' if hypertable else 'tabla normal'} {BENCH_TABLE}")
+        print(f"{'lote':>8} {'values filas/s':>16} {'copy filas/s':>14} {'mejora':>8}")
+        for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+            values = run(conn, "values", rows, batch_size)
+            copy = run(conn, "copy", rows, batch_size)
+            print(f"{batch_size:>8} {values:>16.0f} {copy:>14.0f} {copy / values:>7.1f}x")
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Replay offline del pipeline capture -> worker (-> ingest) sobre un video o un
+directorio de JPEGs, sin cámaras RTSP.
+
+Los frames pasan por el mismo código que en producción: `CameraCapture.process`
+(resize, filtro de movimiento, codificación y cola en Redis) y
+`BatchedInferenceServer.step` (lote, tracker ByteTrack, zonas y eventos). Sólo
+cambia el detector: `yolo` carga el modelo real, y un script JSON (o
+`modulo:fabrica`) entrega cajas predefinidas sin pesos ni GPU.
+
+Capture y worker avanzan en lockstep (cada frame se infiere), y el ts de cada
+frame es `inicio + i / fps`, así que los eventos son deterministas a cualquier
+velocidad y se pueden comparar contra una corrida anterior con `--expect`.
+Las claves de Redis usan el prefijo `replay:` para no mezclarse con producción.
+
+Uso:
+    python -m scripts.replay --source 1=clip.mp4 --detector tracks.json --events-out eventos.jsonl
+    python -m scripts.replay --source 1=frames/ --fps 10 --speed 1 --detector yolo --ingest
+
+Formato del script de cajas (índices de frame del origen, cajas en píxeles del frame publicado):
+    {"cameras": {"1": [{"from": 0, "to": 80, "box": [100, 200, 160, 380], "to_box": [400, 200, 460, 380]}]}}
+"""
+import argparse
+import glob
+import importlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+# Antes de importar capture/worker: sus colas se leen de env al importar
+os.environ.setdefault("REDIS_FRAMES_QUEUE", "replay:frames_queue")
+os.environ.setdefault("REDIS_DETECTIONS_STREAM", "replay:detections_stream")
+os.environ.setdefault("ZONE_STATE_PREFIX", "replay:zone_state")
+os.environ.setdefault("EVENT_LOG_EVERY", "0")
+# Lockstep: cada frame publicado se infiere, sin descarte por atraso que vuelva no determinista la corrida
+os.environ.setdefault("WORKER_MAX_FRAME_AGE_MS", "0")
+os.environ.setdefault("WORKER_MAX_INFER_EVERY", "1")
+
+
+# --- Orígenes de frames ---
+
+def iter_source(path: str):
+    """Itera (índice, frame) de un archivo de video o de un directorio de JPEGs ordenados por nombre."""
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*.jpg")) + glob.glob(os.path.join(path, "*.jpeg")))
+        for i, name in enumerate(files):
+            frame = cv2.imread(name)
+            if frame is not None:
+                yield i, frame
+        return
+    cap = cv2.VideoCapture(path)
+    i = 0
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        yield i, frame
+        i += 1
+    cap.release()
+
+
+def source_fps(path: str, default: float) -> float:
+    if os.path.isdir(path):
+        return default
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else default
+
+
+# --- Detectores de prueba ---
+
+class ScriptedDetector:
+    """Cajas de persona interpoladas linealmente entre `box` y `to_box` en el rango [from, to] de frames."""
+
+    def __init__(self, script: dict):
+        self.tracks = {int(cid): tracks for cid, tracks in script.get("cameras", {}).items()}
+
+    @classmethod
+    def from_file(cls, path: str) -> "ScriptedDetector":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def detect(self, camera_id: int, frame_index: int, frame) -> list:
+        boxes = []
+        for track in self.tracks.get(camera_id, []):
+            start, end = track["from"], track["to"]
+            if not start <= frame_index <= end:
+                continue
+            a = np.asarray(track["box"], dtype=float)
+            b = np.asarray(track.get("to_box", track["box"]), dtype=float)
+            k = (frame_index - start) / (end - start) if end > start else 0.0
+            boxes.append([*(a + k * (b - a)), track.get("conf", 0.9), 0])
+        return boxes
+
+
+class NoDetector:
+    """Sin detecciones: mide sólo el costo del transporte, el decode y el tracking vacío."""
+
+    def detect(self, camera_id: int, frame_index: int, frame) -> list:
+        return []
+
+
+def make_detector(spec: str):
+    if spec == "none":
+        return NoDetector()
+    if spec.endswith(".json"):
+        return ScriptedDetector.from_file(spec)
+    # "paquete.modulo:fabrica" -> objeto con detect(camera_id, frame_index, frame)
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)()
+
+
+# --- Replay ---
+
+def _replay_server_class():
+    from worker.inference import BatchedInferenceServer
+
+    class ReplayInferenceServer(BatchedInferenceServer):
+        """El servidor del worker con `predict` reemplazado por un detector de prueba."""
+
+        def __init__(self, detector, t0: float, fps: float, *args, **kwargs):
+            super().__init__(None, *args, **kwargs)
+            self.detector = detector
+            self.t0 = t0
+            self.source_fps = fps
+
+        def predict(self, batch) -> list:
+            import torch
+            from ultralytics.engine.results import Results
+
+            results = []
+            for pipeline, header, frame in batch:
+                frame_index = round((header.ts - self.t0) * self.source_fps)
+                boxes = self.detector.detect(pipeline.camera_id, frame_index, frame)
+                boxes = torch.tensor(boxes, dtype=torch.float32).reshape(-1, 6)
+                results.append(Results(frame, path="", names={0: "person"}, boxes=boxes))
+            return results
+
+        def warmup(self) -> float:
+            return 0.0
+
+    return ReplayInferenceServer
+
+
+def _clear_keys(redis_client, camera_ids):
+    from shared.events import DETECTIONS_STREAM_KEY
+    from shared.frame_queue import frames_queue_key, frames_stats_key
+
+    keys = [DETECTIONS_STREAM_KEY]
+    for camera_id in camera_ids:
+        keys += [frames_queue_key(camera_id), frames_stats_key(camera_id)]
+    redis_client.delete(*keys)
+
+
+def run_replay(args) -> list:
+    import redis
+
+    from capture.capture import CameraCapture
+    from shared.camera_config import find_camera, load_config
+    from shared.events import DETECTIONS_STREAM_KEY, EVENT_FIELD, decode_event
+    from shared.settings import settings
+    from worker.events import EventPublisher
+    from worker.inference import BatchedInferenceServer
+    from worker.pipeline import CameraPipeline
+
+    sources = {}
+    for spec in args.source:
+        camera_id, _, path = spec.partition("=")
+        sources[int(camera_id)] = path
+    fps = args.fps or source_fps(next(iter(sources.values())), 10.0)
+
+    cfg = load_config(args.config) if args.config else load_config()
+    cameras = {}
+    for camera_id in sources:
+        tenant_id, cam = find_camera(cfg, camera_id)
+        if cam is None:
+            raise RuntimeError(f"Replay: Camera id {camera_id} not found in config")
+        cameras[camera_id] = (tenant_id, cam)
+
+    redis_client = redis.from_url(settings.redis_url.unicode_string(), decode_responses=True)
+    frames_client = redis.from_url(settings.redis_url.unicode_string())
+    _clear_keys(frames_client, sources)
+
+    captures = {cid: CameraCapture(cam, frames_client) for cid, (_, cam) in cameras.items()}
+    events = EventPublisher(redis_client)
+    pipelines = [CameraPipeline(tenant_id, cam, redis_client, events) for tenant_id, cam in cameras.values()]
+
+    t0 = time.time()
+    if args.detector == "yolo":
+        from worker.backend import load_model
+        server = BatchedInferenceServer(load_model(), pipelines, frames_client, events)
+    else:
+        server = _replay_server_class()(make_detector(args.detector), t0, fps, pipelines, frames_client, events)
+    server.warmup()
+
+    iterators = {cid: iter_source(path) for cid, path in sources.items()}
+    capture_time = worker_time = 0.0
+    frames_read = frames_published = 0
+    start = time.time()
+    while iterators:
+        tick_published = False
+        t_capture = time.time()
+        for camera_id, it in list(iterators.items()):
+            item = next(it, None)
+            if item is None or (args.max_frames and item[0] >= args.max_frames):
+                del iterators[camera_id]
+                continue
+            frame_index, frame = item
+            frames_read += 1
+            if args.speed:
+                # Ritmo real (o acelerado) del video
+                delay = start + frame_index / (fps * args.speed) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if captures[camera_id].process(frame, t0 + frame_index / fps):
+                frames_published += 1
+                tick_published = True
+        capture_time += time.time() - t_capture
+
+        if tick_published:
+            t_worker = time.time()
+            server.step()
+            worker_time += time.time() - t_worker
+
+    elapsed = time.time() - start
+    for capture in captures.values():
+        capture.close()
+
+    entries = frames_client.xrange(DETECTIONS_STREAM_KEY)
+    zone_events = [decode_event(fields[EVENT_FIELD.encode()]) for _, fields in entries]
+    for evt in zone_events:
+        # Segundos desde el inicio del replay: comparables entre corridas
+        evt["t"] = round(datetime.fromisoformat(evt["ts"].rstrip("Z")).replace(tzinfo=timezone.utc).timestamp() - t0, 3)
+
+    print(f"Replay: {frames_read} frames leídos, {frames_published} publicados, {len(zone_events)} eventos "
+          f"en {elapsed:.2f} s ({frames_read / max(elapsed, 1e-6):.1f} frames/s)")
+    print(f"  capture: {frames_published / max(capture_time, 1e-6):.1f} frames/s "
+          f"({1000 * capture_time / max(frames_read, 1):.2f} ms por frame)")
+    print(f"  worker:  {server._frames / max(worker_time, 1e-6):.1f} frames/s en {server._batches} lotes")
+    for name, seconds in server.stage_time.items():
+        print(f"    {name:<10} {1000 * seconds / max(server._batches, 1):.2f} ms por lote")
+
+    if args.ingest:
+        _ingest(zone_events)
+
+    _summary(zone_events)
+    for pipeline in pipelines:
+        inside = list(pipeline.zone_states.occupants())
+        if inside:
+            print(f"  cam {pipeline.camera_id}: {len(inside)} tracks siguen dentro de zonas al terminar")
+    return zone_events
+
+
+def _ingest(zone_events: list):
+    """Escribe los eventos con el mismo batch que usa ingest."""
+    from ingest.ingest import BATCH_SIZE, _flush_batch
+    from shared.events import event_key
+
+    # Misma clave que escribió el worker (o la que deriva ingest del ts para eventos sin clave)
+    rows = [(e.get("tenant_id", 1), e["camera_id"], e["zone_id"], e["track_id"], e["event"], e["ts"], e.get("dwell"),
+             e.get("event_key") or event_key(e["camera_id"], e["track_id"], e["zone_id"], e["event"], e["ts"]))
+            for e in zone_events]
+    t = time.time()
+    for i in range(0, len(rows), BATCH_SIZE):
+        _flush_batch(rows[i:i + BATCH_SIZE])
+    elapsed = time.time() - t
+    print(f"  ingest:  {len(rows)} eventos en {elapsed:.2f} s ({len(rows) / max(elapsed, 1e-6):.0f} eventos/s)")
+
+
+def _summary(zone_events: list):
+    counts = {}
+    for e in zone_events:
+        key = (e["camera_id"], e["zone_id"])
+        c = counts.setdefault(key, {"enter": 0, "exit": 0, "dwell": []})
+        c[e["event"]] += 1
+        if e.get("dwell") is not None:
+            c["dwell"].append(e["dwell"])
+    for (camera_id, zone_id), c in sorted(counts.items()):
+        dwell = f", dwell medio {np.mean(c['dwell']):.1f} s" if c["dwell"] else ""
+        print(f"  cam {camera_id} zona {zone_id}: {c['enter']} entradas, {c['exit']} salidas{dwell}")
+
+
+def _event_key(e: dict) -> tuple:
+    return e["camera_id"], e["zone_id"], e["track_id"], e["event"], e["t"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay offline de video/JPEGs por capture y worker.")
+    parser.add_argument("--source", action="append", required=True,
+                        help="camera_id=ruta a un video o a un directorio de JPEGs (repetible).")
+    parser.add_argument("--config", help="config.yaml con las cámaras y zonas (default: el del repo).")
+    parser.add_argument("--fps", type=float, default=0, help="fps del origen (default: los del video, o 10).")
+    parser.add_argument("--speed", type=float, default=0, help="1 = tiempo real, 2 = doble, 0 = sin límite.")
+    parser.add_argument("--max-frames", type=int, default=0)
+    parser.add_argument("--detector", default="none",
+                        help="none | yolo | script.json | paquete.modulo:fabrica")
+    parser.add_argument("--events-out", help="Guardar los eventos resultantes en JSONL.")
+    parser.add_argument("--expect", help="JSONL de una corrida anterior; sale con error si los eventos difieren.")
+    parser.add_argument("--ingest", action="store_true", help="Escribir los eventos en zone_events con ingest.")
+    args = parser.parse_args()
+
+    zone_events = run_replay(args)
+
+    if args.events_out:
+        with open(args.events_out, "w") as f:
+            for e in zone_events:
+                f.write(json.dumps(e) + "\n")
+
+    if args.expect:
+        with open(args.expect) as f:
+            expected = [json.loads(line) for line in f if line.strip()]
+        got, want = [_event_key(e) for e in zone_events], [_event_key(e) for e in expected]
+        if got != want:
+            missing = set(want) - set(got)
+            extra = set(got) - set(want)
+            print(f"Replay: REGRESIÓN, {len(missing)} eventos faltan y {len(extra)} sobran respecto de {args.expect}")
+            for key in sorted(missing)[:10]:
+                print(f"  falta {key}")
+            for key in sorted(extra)[:10]:
+                print(f"  sobra {key}")
+            raise SystemExit(1)
+        print(f"Replay: eventos idénticos a {args.expect}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Lectura de cámaras y zonas desde config.yaml para capture y worker."""
+from pathlib import Path
+
+import yaml
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / "config.yaml"
+
+
+def load_config(path: Path = CONFIG_PATH) -> dict:
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def find_camera(cfg: dict, camera_id: int):
+    """Devuelve (tenant_id, cam_cfg) de la cámara o (None, None) si no existe."""
+    for tenant in cfg.get("tenants", []):
+        for cam in tenant.get("cameras", []):
+            if cam["id"] == camera_id:
+                return tenant["id"], cam
+    return None, None
+
+
+def tenant_cameras(cfg: dict, tenant_id: int) -> list:
+    """Todas las cámaras declaradas para un tenant."""
+    for tenant in cfg.get("tenants", []):
+        if tenant["id"] == tenant_id:
+            return list(tenant.get("cameras", []))
+    return []
+
+
+def zone_reference(cam_cfg: dict, zone_cfg: dict):
+    """
+    Resolución (ancho, alto) en la que se dibujó el polígono de la zona: `resolution`
+    de la zona o `zone_resolution` de la cámara. None = coordenadas del frame recibido.
+    """
+    ref = zone_cfg.get("resolution") or cam_cfg.get("zone_resolution")
+    return tuple(ref) if ref else None
+
+
+def scale_polygon(points, reference, frame_size):
+    """Escala los puntos del polígono de `reference` (ancho, alto) al `frame_size` (ancho, alto)."""
+    if reference is None or tuple(reference) == tuple(frame_size):
+        return [tuple(p) for p in points]
+    sx = frame_size[0] / reference[0]
+    sy = frame_size[1] / reference[1]
+    return [(x * sx, y * sy) for x, y in points]
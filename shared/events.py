@@ -0,0 +1,63 @@
+"""
+Codificación de los eventos de zona que viajan de worker a ingest por Redis.
+
+Por defecto se usa JSON. Con EVENTS_ENCODING=msgpack (y el paquete `msgpack`
+instalado) los eventos se codifican en binario, más compactos y rápidos de
+parsear. `decode_event` acepta ambos formatos, así que ingest puede consumir
+una cola mixta durante el despliegue.
+
+Los eventos viajan en un Redis Stream (`detections_stream`), un evento por
+entrada en el campo `e`. Ingest lo consume con un consumer group y confirma
+(XACK) cada entrada sólo después del commit en la base de datos.
+
+Cada evento lleva una clave determinística (`event_key`) derivada de cámara,
+track, zona, tipo de evento y secuencia del frame: reintentos de ingest,
+reentregas del stream y replays del journal producen la misma clave, y la
+base descarta la fila repetida.
+"""
+import json
+import os
+import uuid
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional
+    msgpack = None
+
+EVENTS_ENCODING = os.getenv("EVENTS_ENCODING", "json").lower()
+
+DETECTIONS_STREAM_KEY = os.getenv("REDIS_DETECTIONS_STREAM", "detections_stream")
+# Campo de cada entrada del stream con el evento codificado
+EVENT_FIELD = "e"
+# Largo aproximado máximo del stream (XADD MAXLEN ~). Debe cubrir cualquier caída razonable de ingest:
+# las entradas más viejas se descartan aunque no se hayan confirmado.
+EVENTS_STREAM_MAXLEN = int(os.getenv("EVENTS_STREAM_MAXLEN", 1000000))
+
+# Namespace fijo para uuid5: cambiarlo cambia todas las claves y rompe la deduplicación
+EVENT_KEY_NAMESPACE = uuid.UUID("446f5e8f-3f5e-408c-b5b2-66c767da024f")
+
+if EVENTS_ENCODING == "msgpack" and msgpack is None:
+    print("EVENTS_ENCODING=msgpack pero el paquete msgpack no está instalado; se usará JSON")
+    EVENTS_ENCODING = "json"
+
+
+def encode_event(evt: dict):
+    if EVENTS_ENCODING == "msgpack":
+        return msgpack.packb(evt, use_bin_type=True)
+    return json.dumps(evt)
+
+
+def event_key(camera_id: int, track_id: int, zone_id: int, event: str, seq) -> str:
+    """Clave determinística de una transición de zona (UUID v5 como texto)."""
+    return str(uuid.uuid5(EVENT_KEY_NAMESPACE, f"{camera_id}:{track_id}:{zone_id}:{event}:{seq}"))
+
+
+def decode_event(item) -> dict:
+    """Decodifica un evento en JSON (str o bytes) o msgpack (bytes)."""
+    if isinstance(item, str):
+        return json.loads(item)
+    if item[:1] == b"{":
+        return json.loads(item)
+    if msgpack is None:
+        raise ValueError("Evento en msgpack recibido pero el paquete msgpack no está instalado")
+    return msgpack.unpackb(item, raw=False)
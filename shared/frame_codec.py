@@ -0,0 +1,59 @@
+"""
+Formato binario de transporte de frames entre capture y worker.
+
+Cada mensaje es una cabecera fija little-endian seguida del payload crudo
+(bytes JPEG o píxeles BGR), sin base64 ni JSON de por medio:
+
+    magic "VF" | version u8 | encoding u8 | camera_id u32 | seq u64 | ts f64 | width u16 | height u16
+
+El campo `version` permite desplegar cambios de formato de forma gradual:
+`decode_frame` rechaza con ValueError lo que no reconoce (magic o versión), y
+el worker descarta ese mensaje y sigue con los demás.
+"""
+import struct
+from typing import NamedTuple
+
+MAGIC = b"VF"
+VERSION = 1
+
+ENCODING_JPEG = 0
+ENCODING_BGR = 1
+# Sin payload: el frame está en el ring de memoria compartida (ver shared/shm_ring.py)
+ENCODING_SHM = 2
+
+_HEADER = struct.Struct("<2sBBIQdHH")
+HEADER_SIZE = _HEADER.size
+
+
+class FrameHeader(NamedTuple):
+    version: int
+    encoding: int
+    camera_id: int
+    seq: int
+    ts: float
+    width: int
+    height: int
+
+
+def encode_frame(camera_id: int, seq: int, ts: float, payload, encoding: int = ENCODING_JPEG,
+                 width: int = 0, height: int = 0) -> bytes:
+    """Serializa cabecera + payload en un único buffer listo para Redis."""
+    header = _HEADER.pack(MAGIC, VERSION, encoding, camera_id, seq, ts, width, height)
+    # join acepta cualquier objeto con buffer protocol (ndarray incluido): una sola copia
+    return b"".join((header, payload))
+
+
+def decode_frame(data: bytes):
+    """
+    Devuelve (FrameHeader, payload). El payload es un memoryview sobre `data`
+    para no copiar los píxeles. Lanza ValueError si el mensaje no es un frame
+    de una versión conocida.
+    """
+    if len(data) < HEADER_SIZE or data[:2] != MAGIC:
+        raise ValueError(f"Mensaje de frame sin cabecera válida ({len(data)} bytes)")
+
+    magic, version, encoding, camera_id, seq, ts, width, height = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Versión de frame no soportada: {version}")
+    header = FrameHeader(version, encoding, camera_id, seq, ts, width, height)
+    return header, memoryview(data)[HEADER_SIZE:]
@@ -0,0 +1,101 @@
+"""
+Colas de frames por cámara en Redis.
+
+Cada cámara publica en su propia lista acotada (`frames_queue:cam_{id}`). El
+capture hace RPUSH + LTRIM en un mismo pipeline: si el worker se atrasa se
+descartan los frames más viejos y siempre gana el más reciente, así que la
+memoria de Redis se mantiene plana. Los contadores viven en un hash por cámara.
+"""
+import os
+
+FRAMES_QUEUE_PREFIX = os.getenv("REDIS_FRAMES_QUEUE", "frames_queue")
+FRAMES_QUEUE_MAXLEN = int(os.getenv("FRAMES_QUEUE_MAXLEN", 2))
+
+
+def frames_queue_key(camera_id: int) -> str:
+    return f"{FRAMES_QUEUE_PREFIX}:cam_{camera_id}"
+
+
+def frames_stats_key(camera_id: int) -> str:
+    return f"{FRAMES_QUEUE_PREFIX}:stats:cam_{camera_id}"
+
+
+def push_frame(redis_client, camera_id: int, data, maxlen: int = FRAMES_QUEUE_MAXLEN) -> int:
+    """
+    Empuja un frame a la cola de la cámara descartando los más viejos.
+    Devuelve cuántos frames se descartaron para respetar `maxlen`.
+    """
+    key = frames_queue_key(camera_id)
+    stats_key = frames_stats_key(camera_id)
+
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.rpush(key, data)
+    pipe.ltrim(key, -maxlen, -1)
+    pipe.hincrby(stats_key, "pushed", 1)
+    length = pipe.execute()[0]
+
+    dropped = max(0, length - maxlen)
+    if dropped:
+        redis_client.hincrby(stats_key, "dropped", dropped)
+    return dropped
+
+
+def queue_stats(redis_client, camera_id: int) -> dict:
+    """Profundidad actual de la cola, contadores acumulados (pushed/popped/dropped) y métricas del hash de stats."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.llen(frames_queue_key(camera_id))
+    pipe.hgetall(frames_stats_key(camera_id))
+    depth, counters = pipe.execute()
+
+    stats = {"depth": depth}
+    for field, value in counters.items():
+        if isinstance(field, bytes):
+            field = field.decode()
+        # El capture y el worker también guardan métricas con decimales (fps, ms)
+        value = float(value)
+        stats[field] = int(value) if value.is_integer() else value
+    return stats
+
+
+def pop_latest_frames(redis_client, camera_ids) -> dict:
+    """
+    Toma sin bloquear el frame más reciente de cada cámara y vacía su cola, todo en
+    un único round trip (MULTI/EXEC). Devuelve {camera_id: data} sólo para las
+    cámaras que tenían frames; los más viejos se cuentan como `skipped`.
+    """
+    camera_ids = list(camera_ids)
+    pipe = redis_client.pipeline()
+    for camera_id in camera_ids:
+        key = frames_queue_key(camera_id)
+        pipe.llen(key)
+        pipe.rpop(key)
+        pipe.delete(key)
+    replies = pipe.execute()
+
+    frames = {}
+    stats_pipe = redis_client.pipeline(transaction=False)
+    for i, camera_id in enumerate(camera_ids):
+        depth, data = replies[3 * i], replies[3 * i + 1]
+        if data is None:
+            continue
+        frames[camera_id] = data
+        stats_pipe.hincrby(frames_stats_key(camera_id), "popped", 1)
+        if depth > 1:
+            stats_pipe.hincrby(frames_stats_key(camera_id), "skipped", depth - 1)
+    if frames:
+        stats_pipe.execute()
+    return frames
+
+
+def wait_any_frame(redis_client, camera_ids, timeout: int = 30):
+    """Bloquea hasta que alguna de las cámaras tenga un frame. Devuelve (camera_id, data) o None."""
+    keys = {frames_queue_key(camera_id): camera_id for camera_id in camera_ids}
+    item = redis_client.blpop(list(keys), timeout=timeout)
+    if item is None:
+        return None
+    key, data = item
+    if isinstance(key, bytes):
+        key = key.decode()
+    camera_id = keys[key]
+    redis_client.hincrby(frames_stats_key(camera_id), "popped", 1)
+    return camera_id, data
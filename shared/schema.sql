@@ -11,12 +11,43 @@ CREATE TABLE IF NOT EXISTS zone_events (
     event     TEXT,
     ts        TIMESTAMPTZ NOT NULL,
     dwell_seconds FLOAT,
+    event_key UUID,
     PRIMARY KEY (id, ts)
 );
 
+-- Clave determinística del evento (ver shared/events.py): ingest escribe con
+-- ON CONFLICT DO NOTHING, así reintentos y reentregas no duplican filas.
+-- En una hypertable todo índice único tiene que incluir la columna de partición (ts).
+ALTER TABLE zone_events ADD COLUMN IF NOT EXISTS event_key UUID;
+
 -- Convertir a hypertable particionada por hora
 SELECT create_hypertable('zone_events', 'ts', if_not_exists => TRUE, chunk_time_interval => INTERVAL '1 hour');
 
+CREATE UNIQUE INDEX IF NOT EXISTS zone_events_event_key_ts_idx ON zone_events (event_key, ts);
+-- Búsqueda del último evento de un track en una zona (ocupación del API y cierre de visitas en ingest)
+CREATE INDEX IF NOT EXISTS zone_events_zone_track_ts_idx ON zone_events (zone_id, track_id, ts DESC);
+
+-- Visitas: un enter emparejado con su exit, mantenidas por ingest (ver ingest/visits.py).
+-- exit_ts NULL = visita abierta. closed_by: 'exit' o 'timeout' (ghost_timeout_minutes de la zona,
+-- con dwell_seconds NULL porque no se sabe cuándo salió).
+CREATE TABLE IF NOT EXISTS zone_visits (
+    tenant_id INT DEFAULT 1,
+    camera_id INT NOT NULL,
+    zone_id   INT NOT NULL,
+    track_id  INT NOT NULL,
+    enter_ts  TIMESTAMPTZ NOT NULL,
+    exit_ts   TIMESTAMPTZ,
+    dwell_seconds FLOAT,
+    closed_by TEXT,
+    enter_key UUID,
+    PRIMARY KEY (camera_id, zone_id, track_id, enter_ts)
+);
+
+SELECT create_hypertable('zone_visits', 'enter_ts', if_not_exists => TRUE, chunk_time_interval => INTERVAL '1 day');
+
+CREATE INDEX IF NOT EXISTS zone_visits_zone_enter_idx ON zone_visits (zone_id, enter_ts DESC);
+CREATE INDEX IF NOT EXISTS zone_visits_open_idx ON zone_visits (zone_id, enter_ts) WHERE exit_ts IS NULL;
+
 -- Continuous aggregate para dwell_stats_minute
 CREATE MATERIALIZED VIEW IF NOT EXISTS dwell_stats_minute
 WITH (timescaledb.continuous) AS
@@ -48,9 +79,13 @@ CREATE TABLE IF NOT EXISTS zones (
     name TEXT,
     metrics TEXT[], -- Cambiado de 'type' a 'metrics' para soportar múltiples
     polygon JSONB,
+    ghost_timeout_minutes INT DEFAULT 60,
     created_at TIMESTAMPTZ DEFAULT now()
 );
 
+-- Bases creadas antes de que config_loader escribiera el timeout por zona
+ALTER TABLE zones ADD COLUMN IF NOT EXISTS ghost_timeout_minutes INT DEFAULT 60;
+
 -- Tabla de umbrales/alertas por zona
 CREATE TABLE IF NOT EXISTS zone_thresholds (
     zone_id INT REFERENCES zones(id) ON DELETE CASCADE,
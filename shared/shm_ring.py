@@ -0,0 +1,140 @@
+"""
+Ring de frames BGR en memoria compartida para capture y worker en el mismo host.
+
+El capture escribe cada frame decodificado en un slot del ring y sólo envía por
+Redis una notificación con el número de secuencia (cabecera v1 con
+`ENCODING_SHM` y payload vacío). El worker mapea el slot como un array de NumPy
+sin copiar. Cada slot guarda su `seq`: el writer lo pone a 0 mientras escribe y
+al terminar lo fija al número de secuencia, de modo que un lector detecta si el
+slot fue sobreescrito comparando el `seq` antes y después de usarlo.
+
+Layout del segmento:
+    cabecera u64[4] (magic, slots, height, width) | seqs u64[slots] | ts f64[slots] | pixels u8[slots, h, w, 3]
+"""
+import os
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+SHM_RING_SLOTS = int(os.getenv("SHM_RING_SLOTS", 4))
+
+_MAGIC = 0x56495352  # "VISR"
+_HEADER_WORDS = 4
+_ALIGN = 64
+# Donde Linux expone los segmentos POSIX; se usa para detectar si el capture recreó el ring
+_SHM_DIR = "/dev/shm"
+
+
+def ring_name(camera_id: int) -> str:
+    return f"vision_frames_cam_{camera_id}"
+
+
+def _layout(slots: int, height: int, width: int):
+    seqs_off = _HEADER_WORDS * 8
+    ts_off = seqs_off + slots * 8
+    pixels_off = -(-(ts_off + slots * 8) // _ALIGN) * _ALIGN
+    size = pixels_off + slots * height * width * 3
+    return seqs_off, ts_off, pixels_off, size
+
+
+class FrameRing:
+    """Un writer (capture) y cualquier número de lectores (workers) por cámara."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        header = np.ndarray((_HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        if int(header[0]) != _MAGIC:
+            raise ValueError(f"El segmento {shm.name} no es un ring de frames")
+        self.slots, self.height, self.width = (int(v) for v in header[1:4])
+
+        seqs_off, ts_off, pixels_off, _ = _layout(self.slots, self.height, self.width)
+        self._seqs = np.ndarray((self.slots,), dtype=np.uint64, buffer=shm.buf, offset=seqs_off)
+        self._ts = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf, offset=ts_off)
+        self._pixels = np.ndarray((self.slots, self.height, self.width, 3), dtype=np.uint8,
+                                  buffer=shm.buf, offset=pixels_off)
+        self._seq = int(self._seqs.max()) if owner else 0
+        # Identidad del segmento mapeado: si el capture lo recrea, el nombre apunta a otro inode
+        self._inode = os.fstat(shm._fd).st_ino if getattr(shm, "_fd", -1) >= 0 else None
+
+    @classmethod
+    def create(cls, camera_id: int, height: int, width: int, slots: int = SHM_RING_SLOTS) -> "FrameRing":
+        """Crea (o recrea, si quedó uno huérfano de una ejecución anterior) el ring de la cámara."""
+        name = ring_name(camera_id)
+        size = _layout(slots, height, width)[3]
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((_HEADER_WORDS,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (_MAGIC, slots, height, width)
+        np.ndarray((slots * 2,), dtype=np.uint64, buffer=shm.buf, offset=_HEADER_WORDS * 8)[:] = 0
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, camera_id: int) -> "FrameRing":
+        """Se conecta a un ring existente. Lanza FileNotFoundError si el capture no corre en este host."""
+        shm = shared_memory.SharedMemory(name=ring_name(camera_id))
+        # Sin esto el resource_tracker de Python borraría el segmento al salir el lector
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def shape(self):
+        return (self.height, self.width, 3)
+
+    def write(self, frame: np.ndarray, ts: float) -> int:
+        """Copia el frame al siguiente slot y devuelve su número de secuencia."""
+        if frame.shape != self.shape:
+            raise ValueError(f"Frame {frame.shape} no coincide con el ring {self.shape}")
+        self._seq += 1
+        slot = self._seq % self.slots
+        self._seqs[slot] = 0
+        self._pixels[slot][...] = frame
+        self._ts[slot] = ts
+        self._seqs[slot] = self._seq
+        return self._seq
+
+    def read(self, seq: int):
+        """
+        Devuelve (ts, frame) donde `frame` es una vista sobre la memoria compartida,
+        o None si el slot ya fue sobreescrito o se está escribiendo.
+        """
+        slot = seq % self.slots
+        if int(self._seqs[slot]) != seq:
+            return None
+        return float(self._ts[slot]), self._pixels[slot]
+
+    def is_current(self, seq: int) -> bool:
+        """True si el slot de `seq` sigue intacto (para validar una vista tras usarla)."""
+        return int(self._seqs[seq % self.slots]) == seq
+
+    def is_stale(self) -> bool:
+        """
+        True si el segmento mapeado ya no es el del capture (lo recreó o lo borró).
+        Es un stat, sin mapear nada; donde no se puede comprobar devuelve True.
+        """
+        if self._inode is None or not os.path.isdir(_SHM_DIR):
+            return True
+        try:
+            return os.stat(os.path.join(_SHM_DIR, self._shm.name.lstrip("/"))).st_ino != self._inode
+        except FileNotFoundError:
+            return True
+
+    def close(self):
+        if self._shm is None:
+            return
+        # Las vistas de NumPy mantienen exportado el buffer; hay que soltarlas antes de cerrar
+        self._seqs = self._ts = self._pixels = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Aún hay vistas vivas (p. ej. el frame en uso); el mmap se libera al recolectarlas
+            pass
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
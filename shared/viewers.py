@@ -0,0 +1,27 @@
+"""
+Registro de espectadores del stream de video anotado.
+
+La API mantiene, por cámara, un sorted set `stream_viewers:cam_{id}` con un
+miembro por conexión abierta a /video/stream/{camera_id} y como score los fps
+pedidos. Cada conexión refresca el TTL del set con un heartbeat; si la API muere
+sin limpiar, el set expira solo. El worker consulta el máximo de fps pedidos y
+sólo anota y codifica frames cuando hay alguien mirando.
+"""
+VIEWER_TTL_SECONDS = 5
+VIEWER_HEARTBEAT_SECONDS = 1.0
+
+
+def viewers_key(camera_id: int) -> str:
+    return f"stream_viewers:cam_{camera_id}"
+
+
+def annotated_frame_key(camera_id: int) -> str:
+    return f"annotated_frame_cam_{camera_id}"
+
+
+def requested_fps(redis_client, camera_id: int):
+    """Máximo de fps pedido por los espectadores de la cámara, o None si nadie mira."""
+    top = redis_client.zrange(viewers_key(camera_id), -1, -1, withscores=True)
+    if not top:
+        return None
+    return float(top[0][1])
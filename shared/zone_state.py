@@ -0,0 +1,96 @@
+"""
+Estado en vivo de las zonas publicado por el worker en Redis.
+
+El worker ya sabe quién está dentro de cada zona, así que publica por zona un
+hash `zone_state:zone_{id}` con la ocupación, los tracks dentro con su hora de
+entrada y el dwell medio de las salidas de los últimos 5 minutos. Se reescribe
+al cambiar y, como mínimo, cada pocos segundos; cada escritura renueva su TTL.
+Un índice `zone_state:index` (sorted set, score = última escritura) permite leer
+todas las zonas vigentes en O(zonas) sin recorrer `zone_events`. Si el worker
+de una cámara se cae, sus zonas dejan de estar vigentes solas.
+
+`read_zone_states` (redis-py, el alerter) y `read_zone_states_async`
+(redis.asyncio, el API) comparten la consulta del índice y el parseo.
+"""
+import json
+import os
+import time
+
+ZONE_STATE_PREFIX = os.getenv("ZONE_STATE_PREFIX", "zone_state")
+# Una zona sin escrituras durante este tiempo se considera sin dato (worker caído o sin frames)
+ZONE_STATE_TTL_SECONDS = int(os.getenv("ZONE_STATE_TTL_SECONDS", 15))
+ZONE_STATE_INDEX_KEY = f"{ZONE_STATE_PREFIX}:index"
+
+
+def zone_state_key(zone_id: int) -> str:
+    return f"{ZONE_STATE_PREFIX}:zone_{zone_id}"
+
+
+def encode_zone_state(camera_id: int, tracks: dict, avg_dwell, updated_ts: float) -> dict:
+    """Mapping del hash de una zona. `tracks` es {track_id: enter_ts}."""
+    return {
+        "camera_id": camera_id,
+        "occupancy": len(tracks),
+        "tracks": json.dumps({str(track_id): round(ts, 3) for track_id, ts in tracks.items()}),
+        "avg_dwell_seconds_5m": "" if avg_dwell is None else round(avg_dwell, 2),
+        "updated_ts": round(updated_ts, 3),
+    }
+
+
+def parse_zone_state(raw: dict):
+    """Convierte el hash leído de Redis (str o bytes) en un dict tipado, o None si expiró."""
+    if not raw:
+        return None
+    raw = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+           for k, v in raw.items()}
+    avg_dwell = raw.get("avg_dwell_seconds_5m")
+    return {
+        "camera_id": int(raw["camera_id"]),
+        "occupancy": int(raw["occupancy"]),
+        "tracks": {int(track_id): ts for track_id, ts in json.loads(raw["tracks"]).items()},
+        "avg_dwell_seconds_5m": float(avg_dwell) if avg_dwell else None,
+        "updated_ts": float(raw["updated_ts"]),
+    }
+
+
+def _live_range(now: float = None) -> tuple:
+    """Argumentos de ZRANGEBYSCORE sobre el índice para las zonas escritas dentro del TTL."""
+    now = time.time() if now is None else now
+    return ZONE_STATE_INDEX_KEY, now - ZONE_STATE_TTL_SECONDS, "+inf"
+
+
+def _parse_states(zone_ids: list, raws: list) -> dict:
+    states = {}
+    for zone_id, raw in zip(zone_ids, raws):
+        state = parse_zone_state(raw)
+        if state is not None:
+            states[zone_id] = state
+    return states
+
+
+def live_zone_ids(redis_client, now: float = None) -> list:
+    """IDs de las zonas con estado escrito dentro del TTL."""
+    return [int(m) for m in redis_client.zrangebyscore(*_live_range(now))]
+
+
+def read_zone_states(redis_client) -> dict:
+    """{zone_id: estado} de todas las zonas vigentes, en dos round trips."""
+    zone_ids = live_zone_ids(redis_client)
+    if not zone_ids:
+        return {}
+    pipe = redis_client.pipeline(transaction=False)
+    for zone_id in zone_ids:
+        pipe.hgetall(zone_state_key(zone_id))
+    return _parse_states(zone_ids, pipe.execute())
+
+
+async def read_zone_states_async(redis_client) -> dict:
+    """Igual que `read_zone_states`, con un cliente de redis.asyncio."""
+    zone_ids = [int(m) for m in await redis_client.zrangebyscore(*_live_range())]
+    if not zone_ids:
+        return {}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for zone_id in zone_ids:
+            pipe.hgetall(zone_state_key(zone_id))
+        raws = await pipe.execute()
+    return _parse_states(zone_ids, raws)
@@ -32,7 +32,7 @@ tmux send-keys -t $SESSION_NAME:2 "uvicorn api.main:app --host 0.0.0.0 --port 88
 
 # Ingest
 tmux new-window -t $SESSION_NAME:3 -n "Ingest"
-tmux send-keys -t $SESSION_NAME:3 "PYTHONPATH=. python3 ingest/ingest.py" C-m
+tmux send-keys -t $SESSION_NAME:3 "PYTHONPATH=. python3 -m ingest.ingest" C-m
 
 # Alerter
 tmux new-window -t $SESSION_NAME:4 -n "Alerter"
@@ -52,20 +52,47 @@ fi
 
 CAMERA_IDS=$(yq e '.tenants[].cameras[].id' config.yaml)
 
+# Con CAPTURE_PER_TENANT=1 se lanza un único proceso de captura por tenant
+# (un thread por stream) en lugar de un proceso por cámara.
+CAPTURE_PER_TENANT=${CAPTURE_PER_TENANT:-0}
+# Con WORKER_PER_TENANT=1 se lanza un único worker por tenant que carga un solo
+# modelo y hace inferencia por lotes sobre todas sus cámaras.
+WORKER_PER_TENANT=${WORKER_PER_TENANT:-0}
+
 WINDOW_INDEX=5
+for TENANT_ID in $(yq e '.tenants[].id' config.yaml)
+do
+  if [ "$CAPTURE_PER_TENANT" = "1" ]; then
+    echo "Lanzando captura multi-cámara para Tenant ID: $TENANT_ID"
+    tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Capture-T$TENANT_ID"
+    tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "CAPTURE_TENANT_ID=$TENANT_ID PYTHONPATH=. python3 -m capture.capture" C-m
+    let WINDOW_INDEX++
+  fi
+  if [ "$WORKER_PER_TENANT" = "1" ]; then
+    echo "Lanzando worker multi-cámara para Tenant ID: $TENANT_ID"
+    tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Worker-T$TENANT_ID"
+    tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "WORKER_TENANT_ID=$TENANT_ID PYTHONPATH=. python3 -m worker.worker" C-m
+    let WINDOW_INDEX++
+  fi
+done
+
 for CAM_ID in $CAMERA_IDS
 do
   echo "Lanzando servicios para Cámara ID: $CAM_ID"
   
   # Capture
-  tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Capture-$CAM_ID"
-  tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "CAMERA_ID=$CAM_ID PYTHONPATH=. python3 capture/capture.py" C-m
-  let WINDOW_INDEX++
+  if [ "$CAPTURE_PER_TENANT" != "1" ]; then
+    tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Capture-$CAM_ID"
+    tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "CAMERA_ID=$CAM_ID PYTHONPATH=. python3 -m capture.capture" C-m
+    let WINDOW_INDEX++
+  fi
 
   # Worker
-  tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Worker-$CAM_ID"
-  tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "CAMERA_ID=$CAM_ID PYTHONPATH=. python3 worker/worker.py" C-m
-  let WINDOW_INDEX++
+  if [ "$WORKER_PER_TENANT" != "1" ]; then
+    tmux new-window -t $SESSION_NAME:$WINDOW_INDEX -n "Worker-$CAM_ID"
+    tmux send-keys -t $SESSION_NAME:$WINDOW_INDEX "CAMERA_ID=$CAM_ID PYTHONPATH=. python3 -m worker.worker" C-m
+    let WINDOW_INDEX++
+  fi
 done
 
 # --- Finalización ---
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+pytest.importorskip("onnxruntime")
+
+from worker import backend
+
+IMGSZ = 320
+
+
+def _weights(tmp_path, config: str) -> str:
+    """Checkpoint .pt armado desde el yaml del modelo (pesos al azar, sin descargas)."""
+    import torch
+    from ultralytics import __version__
+
+    model = backend._yolo()(config)
+    path = tmp_path / config.replace(".yaml", ".pt")
+    torch.save({"model": model.model, "train_args": {}, "version": __version__}, path)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def export_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, "MODEL_EXPORT_DIR", str(tmp_path / "model_cache"))
+
+
+@pytest.mark.parametrize("config", ["yolov8n.yaml", "yolov8s-worldv2.yaml"])
+def test_onnx_export_and_predict(tmp_path, config):
+    weights = _weights(tmp_path, config)
+    model = backend.load_model(weights, backend="onnx", threads=1, imgsz=IMGSZ)
+
+    frames = [np.zeros((240, 320, 3), dtype=np.uint8)] * 2
+    results = model.predict(frames, classes=[0], verbose=False)
+    assert len(results) == 2
+
+    # La segunda carga reutiliza la exportación cacheada
+    target = backend.exported_path(weights, "onnx", IMGSZ)
+    exported_at = os.path.getmtime(target)
+    assert backend.export_model(weights, "onnx", IMGSZ) == target
+    assert os.path.getmtime(target) == exported_at
+
+
+def test_world_v1_is_rejected(tmp_path):
+    weights = _weights(tmp_path, "yolov8s-world.yaml")
+    with pytest.raises(RuntimeError, match="YOLO-World v1"):
+        backend.export_model(weights, "onnx", IMGSZ)
@@ -0,0 +1,57 @@
+import numpy as np
+from shapely.geometry import Point, Polygon
+
+from shared.camera_config import scale_polygon
+from worker.zones import ZoneMask
+
+FRAME_SIZE = (640, 480)
+
+ZONES = {
+    10: [(50, 40), (300, 60), (280, 300), (70, 260)],
+    # Se superpone con la zona 10
+    20: [(200, 150), (500, 120), (560, 400), (230, 420)],
+    # Cóncava y con vértices no enteros
+    30: [(400.5, 20.25), (620, 30), (610.75, 110), (520, 70.5), (430, 115)],
+}
+
+
+def _random_points(rng, n, frame_size, polygons, margin=1.0):
+    """Puntos al azar del frame a más de `margin` píxeles de cualquier borde."""
+    width, height = frame_size
+    xs = rng.uniform(0, width - 1, n)
+    ys = rng.uniform(0, height - 1, n)
+    borders = [Polygon(points).exterior for points in polygons.values()]
+    keep = [all(border.distance(Point(x, y)) > margin for border in borders) for x, y in zip(xs, ys)]
+    return xs[keep], ys[keep]
+
+
+def _assert_matches_shapely(polygons, frame_size, seed):
+    rng = np.random.default_rng(seed)
+    mask = ZoneMask(polygons, frame_size)
+    xs, ys = _random_points(rng, 4000, frame_size, polygons)
+    assert len(xs) > 1000
+
+    got = mask.membership(xs, ys)
+    shapes = [Polygon(polygons[zone_id]) for zone_id in mask.zone_ids.tolist()]
+    want = np.array([[shape.contains(Point(x, y)) for shape in shapes] for x, y in zip(xs, ys)])
+    np.testing.assert_array_equal(got, want)
+    return got
+
+
+def test_membership_matches_shapely():
+    got = _assert_matches_shapely(ZONES, FRAME_SIZE, seed=0)
+    # La muestra tiene que cubrir la intersección de las zonas superpuestas
+    assert (got[:, 0] & got[:, 1]).any()
+
+
+def test_membership_matches_shapely_scaled_resolution():
+    frame_size = (1280, 720)
+    scaled = {zone_id: scale_polygon(points, FRAME_SIZE, frame_size) for zone_id, points in ZONES.items()}
+    _assert_matches_shapely(scaled, frame_size, seed=1)
+
+
+def test_pairs_and_out_of_frame_points():
+    mask = ZoneMask(ZONES, FRAME_SIZE)
+    pairs = mask.pairs([1, 2, 3, 4], [150, 250, -20, 700], [150, 200, 50, 100])
+    assert pairs == {(1, 10), (2, 10), (2, 20)}
+    assert mask.pairs([], [], []) == set()
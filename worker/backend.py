@@ -0,0 +1,200 @@
+"""
+Carga del modelo YOLO con backend seleccionable.
+
+- torch (default): los pesos .pt tal cual, en GPU si hay.
+- onnx: se exporta una vez a ONNX y se corre con ONNX Runtime en CPU.
+- openvino: se exporta una vez a OpenVINO IR y se corre en CPU con OpenVINO.
+
+La exportación se cachea en MODEL_EXPORT_DIR (una por pesos, backend e imgsz) y
+sólo se rehace si los pesos son más nuevos que la exportación. En todos los
+casos se devuelve un objeto `YOLO` de ultralytics, así que `predict` entrega los
+mismos `Results` y el tracking y la lógica de zonas no cambian.
+
+Con torch, el modelo fusionado también se cachea: los reinicios cargan un
+checkpoint que ya no hay que fusionar en el primer predict.
+
+Sólo se pueden exportar YOLOv8 de clases fijas (p. ej. yolov8s.pt) y YOLO-World
+v2 (yolov8s-worldv2.pt). YOLO-World v1, como el default yolov8s-world.pt, no lo
+exporta ultralytics: con esos pesos los backends onnx/openvino fallan al cargar.
+"""
+import os
+import shutil
+import time
+
+import numpy as np
+
+MODEL_WEIGHTS = os.getenv("YOLO_WEIGHTS", "weights/yolov8s-world.pt")
+# torch | onnx | openvino
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+# Threads de inferencia en CPU (0 = lo que decida el runtime)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", 0))
+# Tamaño de entrada fijo de los modelos exportados
+INFERENCE_IMGSZ = int(os.getenv("INFERENCE_IMGSZ", 640))
+MODEL_EXPORT_DIR = os.getenv("MODEL_EXPORT_DIR", "model_cache")
+# Backend torch: guardar en MODEL_EXPORT_DIR el modelo ya fusionado (conv+bn) para los reinicios
+FUSED_MODEL_CACHE = os.getenv("FUSED_MODEL_CACHE", "1") == "1"
+
+BACKENDS = ("torch", "onnx", "openvino")
+# Opset fijo: con torch reciente ultralytics 8.1 elige opset 10, que no tiene el einsum de YOLO-World v2
+ONNX_OPSET = 17
+
+
+def _yolo():
+    import torch
+
+    # FIX: PyTorch >= 2.6 rompe la carga de modelos de ultralytics.
+    # "Parcheamos" torch.load para forzar weights_only=False, ya que confiamos
+    # en la fuente del modelo. Esto soluciona el problema de raíz.
+    if not getattr(torch.load, "_weights_only_patched", False):
+        original_torch_load = torch.load
+        torch.load = lambda *args, **kwargs: original_torch_load(*args, weights_only=False, **kwargs)
+        torch.load._weights_only_patched = True
+
+    from ultralytics import YOLO
+    return YOLO
+
+
+def _legacy_onnx_export():
+    """
+    torch >= 2.9 exporta a ONNX con dynamo por default, que necesita onnxscript y
+    no es el camino que usa ultralytics 8.1: se fuerza el exportador de TorchScript.
+    """
+    import inspect
+
+    import torch.onnx
+
+    export = torch.onnx.export
+    if getattr(export, "_dynamo_patched", False) or "dynamo" not in inspect.signature(export).parameters:
+        return
+    torch.onnx.export = lambda *args, **kwargs: export(*args, **{"dynamo": False, **kwargs})
+    torch.onnx.export._dynamo_patched = True
+
+
+def _check_exportable(model, weights: str):
+    """Falla con un mensaje claro si los pesos son de YOLO-World v1, que ultralytics no puede exportar."""
+    # Lo que distingue a v1 de v2 es el ImagePoolingAttn del head
+    if any(type(m).__name__ == "ImagePoolingAttn" for m in model.model.modules()):
+        raise RuntimeError(
+            f"{weights} es un modelo YOLO-World v1, que no se puede exportar a ONNX/OpenVINO. "
+            f"Usar INFERENCE_BACKEND=torch, o YOLO_WEIGHTS con un YOLO-World v2 (yolov8s-worldv2.pt) "
+            f"o un YOLOv8 de clases fijas (yolov8s.pt)"
+        )
+
+
+def exported_path(weights: str, backend: str, imgsz: int = INFERENCE_IMGSZ) -> str:
+    """Ruta de la exportación cacheada: un archivo .onnx o un directorio de OpenVINO."""
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    if backend == "onnx":
+        return os.path.join(MODEL_EXPORT_DIR, f"{stem}_{imgsz}.onnx")
+    return os.path.join(MODEL_EXPORT_DIR, f"{stem}_{imgsz}_openvino_model")
+
+
+def fused_path(weights: str) -> str:
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    # Se conserva el sufijo del nombre (p. ej. "-world") porque ultralytics elige la clase por él
+    return os.path.join(MODEL_EXPORT_DIR, f"{stem}_fused.pt")
+
+
+def _load_torch(weights: str):
+    """Carga los pesos .pt, usando (y si falta, creando) la caché del modelo fusionado."""
+    YOLO = _yolo()
+    cached = fused_path(weights)
+    if FUSED_MODEL_CACHE and os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(weights):
+        try:
+            return YOLO(cached)
+        except Exception as e:
+            print(f"Worker: caché de modelo fusionado inválida ({e}), se regenera")
+
+    model = YOLO(weights)
+    if not FUSED_MODEL_CACHE:
+        return model
+    import torch
+    from ultralytics import __version__
+
+    model.model.fuse(verbose=False)
+    ckpt = getattr(model, "ckpt", None) or {}
+    os.makedirs(MODEL_EXPORT_DIR, exist_ok=True)
+    # Escritura atómica: un worker que arranca en paralelo nunca ve un archivo a medias
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    torch.save({"model": model.model, "train_args": ckpt.get("train_args", {}), "version": __version__}, tmp)
+    os.replace(tmp, cached)
+    print(f"Worker: modelo fusionado cacheado en {cached}")
+    return model
+
+
+def export_model(weights: str, backend: str, imgsz: int = INFERENCE_IMGSZ) -> str:
+    """Exporta los pesos al formato del backend si no hay una exportación vigente en caché."""
+    target = exported_path(weights, backend, imgsz)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights):
+        return target
+
+    print(f"Worker: exportando {weights} a {backend} (imgsz {imgsz}), sólo la primera vez...")
+    t0 = time.time()
+    os.makedirs(MODEL_EXPORT_DIR, exist_ok=True)
+    # ultralytics deja la exportación junto a los pesos, y weights/ suele montarse de sólo
+    # lectura: se exporta desde una copia dentro de la caché y se renombra a un nombre estable
+    source = os.path.join(MODEL_EXPORT_DIR, os.path.basename(weights))
+    shutil.copy2(weights, source)
+    try:
+        model = _yolo()(source)
+        _check_exportable(model, weights)
+        _legacy_onnx_export()
+        # dynamic: el servidor de inferencia manda lotes de tamaño variable
+        exported = model.export(format=backend, imgsz=imgsz, dynamic=True, opset=ONNX_OPSET)
+    finally:
+        os.remove(source)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    shutil.move(str(exported), target)
+    print(f"Worker: exportación lista en {target} ({time.time() - t0:.1f} s)")
+    return target
+
+
+def _apply_threads(model, backend: str, path: str, threads: int, imgsz: int):
+    """
+    Limita los threads del runtime. ultralytics no expone la opción, así que se
+    recrea la sesión de ONNX Runtime / el modelo compilado de OpenVINO del
+    AutoBackend (atributos de ultralytics 8.1, la versión fijada en requirements).
+    """
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+        return
+
+    # El predictor (y su AutoBackend) se crea en el primer predict
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+    runtime = model.predictor.model
+
+    if backend == "onnx" and hasattr(runtime, "session"):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        runtime.session = onnxruntime.InferenceSession(
+            path, sess_options=options, providers=["CPUExecutionProvider"])
+    elif backend == "openvino" and hasattr(runtime, "ov_model"):
+        runtime.ov_compiled_model = runtime.core.compile_model(
+            runtime.ov_model, device_name="CPU",
+            config={"PERFORMANCE_HINT": "LATENCY", "INFERENCE_NUM_THREADS": threads})
+    else:
+        print(f"Worker: no se pudo fijar el número de threads para el backend {backend}")
+
+
+def load_model(weights: str = MODEL_WEIGHTS, backend: str = INFERENCE_BACKEND,
+               threads: int = INFERENCE_THREADS, imgsz: int = INFERENCE_IMGSZ):
+    """Devuelve un `YOLO` listo para `predict` con el backend pedido."""
+    if backend not in BACKENDS:
+        raise ValueError(f"INFERENCE_BACKEND debe ser uno de {BACKENDS}, no '{backend}'")
+
+    if backend == "torch":
+        path = weights
+        model = _load_torch(weights)
+    else:
+        path = export_model(weights, backend, imgsz)
+        model = _yolo()(path, task="detect")
+
+    if threads:
+        _apply_threads(model, backend, path, threads, imgsz)
+    return model
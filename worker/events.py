@@ -0,0 +1,62 @@
+"""
+Publicación agrupada de eventos de zona.
+
+Los pipelines de cámara acumulan sus eventos con `add()` y el servidor de
+inferencia llama a `flush()` una vez por lote: todos los eventos salen en un
+único pipeline (un XADD por evento al stream de detecciones), en lugar de un
+round trip a Redis por evento dentro de los bucles de tracks. El log por
+evento se muestrea para no saturar stdout.
+
+El estado en vivo de las zonas (ver shared/zone_state.py) viaja en el mismo
+round trip: cada lote termina en un único pipeline con los XADD y los HSET.
+"""
+import os
+
+from shared.events import DETECTIONS_STREAM_KEY, EVENT_FIELD, EVENTS_STREAM_MAXLEN, encode_event
+from shared.zone_state import ZONE_STATE_INDEX_KEY, ZONE_STATE_TTL_SECONDS, zone_state_key
+
+# Imprimir 1 de cada N eventos (1 = todos, 0 = ninguno)
+EVENT_LOG_EVERY = int(os.getenv("EVENT_LOG_EVERY", 50))
+
+
+class EventPublisher:
+    def __init__(self, redis_client, stream_key: str = DETECTIONS_STREAM_KEY):
+        self.redis = redis_client
+        self.stream_key = stream_key
+        self._pending = []
+        self._states = {}
+        self._count = 0
+
+    def add(self, evt: dict, zone_name: str = ""):
+        self._pending.append(encode_event(evt))
+        self._count += 1
+        if EVENT_LOG_EVERY and self._count % EVENT_LOG_EVERY == 0:
+            action = "ENTERED" if evt["event"] == "enter" else "EXITED"
+            print(f"EVENT (1/{EVENT_LOG_EVERY}): Track {evt['track_id']} {action} zone {evt['zone_id']} "
+                  f"('{zone_name}') cam {evt['camera_id']}")
+
+    def set_zone_state(self, zone_id: int, mapping: dict):
+        """Encola el estado en vivo de una zona; dentro de un lote gana la última escritura."""
+        self._states[zone_id] = mapping
+
+    def flush(self) -> int:
+        """Envía eventos y estados acumulados en un solo round trip. Devuelve cuántos eventos se enviaron."""
+        if not self._pending and not self._states:
+            return 0
+        pending, self._pending = self._pending, []
+        states, self._states = self._states, {}
+
+        pipe = self.redis.pipeline(transaction=False)
+        for payload in pending:
+            pipe.xadd(self.stream_key, {EVENT_FIELD: payload}, maxlen=EVENTS_STREAM_MAXLEN, approximate=True)
+        for zone_id, mapping in states.items():
+            key = zone_state_key(zone_id)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, ZONE_STATE_TTL_SECONDS)
+        if states:
+            now = max(mapping["updated_ts"] for mapping in states.values())
+            pipe.zadd(ZONE_STATE_INDEX_KEY, {str(zone_id): mapping["updated_ts"] for zone_id, mapping in states.items()})
+            # Zonas sin escrituras hace mucho (cámaras dadas de baja): no dejar crecer el índice
+            pipe.zremrangebyscore(ZONE_STATE_INDEX_KEY, "-inf", now - 10 * ZONE_STATE_TTL_SECONDS)
+        pipe.execute()
+        return len(pending)
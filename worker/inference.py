@@ -0,0 +1,229 @@
+"""
+Inferencia por lotes: un solo modelo YOLO atiende a N cámaras.
+
+En cada ciclo se toma el frame más reciente de cada cámara, se corre un único
+`predict` sobre el lote y cada resultado pasa por el tracker ByteTrack de su
+propia cámara antes de despacharse a su `CameraPipeline`.
+"""
+import os
+import time
+
+import numpy as np
+
+from shared.frame_codec import decode_frame
+from shared.frame_queue import frames_stats_key, pop_latest_frames, queue_stats, wait_any_frame
+
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", 8))
+# Cuánto esperar, tras llegar el primer frame, a que otras cámaras completen el lote
+WORKER_BATCH_WAIT_MS = float(os.getenv("WORKER_BATCH_WAIT_MS", 20))
+# Un frame más viejo que esto al armar el lote se reemplaza por el más nuevo de su cola (0 = no revisar)
+WORKER_MAX_FRAME_AGE_MS = float(os.getenv("WORKER_MAX_FRAME_AGE_MS", 500))
+TRACKER_CONFIG = os.getenv("TRACKER_CONFIG", "bytetrack.yaml")
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 60))
+# Etapas de cada lote: decodificar frames, inferencia, tracker + zonas + anotación, envío de eventos
+STAGES = ("decode", "inference", "zones", "publish")
+
+
+def make_tracker(frame_rate: int = 30):
+    """Crea un BYTETracker con la misma configuración que usa `model.track(tracker=...)`."""
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    from ultralytics.utils import IterableSimpleNamespace, yaml_load
+    from ultralytics.utils.checks import check_yaml
+
+    cfg = IterableSimpleNamespace(**yaml_load(check_yaml(TRACKER_CONFIG)))
+    return BYTETracker(args=cfg, frame_rate=frame_rate)
+
+
+def predict_tracker(tracker, steps: int):
+    """
+    Avanza `steps` frames el filtro de Kalman de los tracks sin detecciones, para
+    cubrir los frames que no pasaron por el modelo (descartados en la cola o por
+    inferencia cada N frames). Así el próximo `update` asocia contra la posición
+    predicha y el timeout de tracks perdidos se mide en frames reales.
+    """
+    if steps <= 0:
+        return
+    tracks = tracker.tracked_stracks + tracker.lost_stracks
+    if tracks:
+        for _ in range(steps):
+            tracker.multi_predict(tracks)
+    tracker.frame_id += steps
+
+
+def apply_tracker(tracker, result):
+    """
+    Asocia las detecciones de `result` a tracks. Es la lógica de
+    ultralytics.trackers.track.on_predict_postprocess_end, pero con el tracker
+    de la cámara en lugar del del predictor (que se indexa por posición en el lote).
+    """
+    import torch
+
+    det = result.boxes.cpu().numpy()
+    if len(det) == 0:
+        return result
+    tracks = tracker.update(det, result.orig_img)
+    if len(tracks) == 0:
+        return result
+    idx = tracks[:, -1].astype(int)
+    result = result[idx]
+    result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return result
+
+
+class BatchedInferenceServer:
+    def __init__(self, model, pipelines, frames_client, events,
+                 batch_size: int = WORKER_BATCH_SIZE, max_wait_ms: float = WORKER_BATCH_WAIT_MS):
+        self.model = model
+        self.pipelines = {p.camera_id: p for p in pipelines}
+        self.frames_client = frames_client
+        self.events = events
+        self.batch_size = max(1, min(batch_size, len(self.pipelines)))
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_age = WORKER_MAX_FRAME_AGE_MS / 1000.0
+
+        self._frames = 0
+        self._batches = 0
+        # Segundos acumulados por etapa del lote desde el último reporte
+        self.stage_time = dict.fromkeys(STAGES, 0.0)
+        self._window_start = time.time()
+
+    def _gather(self) -> dict:
+        """Devuelve {camera_id: data} con a lo sumo un frame (el más nuevo) por cámara."""
+        camera_ids = list(self.pipelines)
+        first = wait_any_frame(self.frames_client, camera_ids, timeout=30)
+        if first is None:
+            return {}
+        pending = {first[0]: first[1]}
+
+        # Completar el lote con el frame más nuevo de cada cámara hasta llenar o vencer la espera.
+        # La primera pasada incluye la cámara que despertó el BLPOP por si ya hay uno más reciente.
+        deadline = time.time() + self.max_wait
+        candidates = camera_ids
+        while True:
+            pending.update(pop_latest_frames(self.frames_client, candidates))
+            if len(pending) >= self.batch_size or time.time() >= deadline:
+                return pending
+            candidates = [c for c in camera_ids if c not in pending]
+            time.sleep(0.002)
+
+    def warmup(self) -> float:
+        """
+        Corre una inferencia sobre frames negros con la forma esperada de cada
+        cámara, para que la inicialización perezosa del predictor y los kernels
+        de CUDA/CPU no los pague el primer lote real. Devuelve los segundos usados.
+        """
+        t0 = time.time()
+        frames = [np.zeros((h, w, 3), dtype=np.uint8)
+                  for w, h in (p.frame_size_hint for p in list(self.pipelines.values())[:self.batch_size])]
+        self.model.predict(frames, classes=[0], verbose=False)
+        return time.time() - t0
+
+    def _decode_all(self, pending: dict) -> dict:
+        """
+        {camera_id: (header, payload)} de los mensajes del lote. Un mensaje que no
+        se puede leer (corrupto o de una versión desconocida) se cuenta como
+        descartado y se saltea: no puede tirar el worker de todas las cámaras.
+        """
+        decoded = {}
+        for camera_id, data in pending.items():
+            try:
+                decoded[camera_id] = decode_frame(data)
+            except Exception as e:
+                self.pipelines[camera_id].invalid += 1
+                print(f"Worker: mensaje inválido de la cámara {camera_id} descartado: {e}")
+        return decoded
+
+    def _catch_up(self, pending: dict) -> dict:
+        """
+        Si un frame del lote ya viene atrasado (p. ej. esperó en la cola mientras
+        corría la inferencia anterior), se reemplaza por el más nuevo que haya
+        llegado a su cola. Nunca se descarta el único frame disponible.
+        """
+        if not self.max_age:
+            return pending
+        now = time.time()
+        behind = [camera_id for camera_id, (header, _) in pending.items() if now - header.ts > self.max_age]
+        if behind:
+            newer = self._decode_all(pop_latest_frames(self.frames_client, behind))
+            for camera_id in newer:
+                self.pipelines[camera_id].lag_replaced += 1
+            pending.update(newer)
+        return pending
+
+    def step(self):
+        batch = []
+        pending = self._catch_up(self._decode_all(self._gather()))
+        now = t0 = time.time()
+        for camera_id, (header, payload) in pending.items():
+            pipeline = self.pipelines[camera_id]
+            # Bajo carga la cámara puede pasar a inferir 1 de cada N frames: los demás ni se decodifican
+            if not pipeline.should_infer(header, now):
+                continue
+            try:
+                frame = pipeline.decode_payload(header, payload)
+            except Exception as e:
+                # Cabecera válida pero payload que no corresponde (p. ej. BGR truncado)
+                pipeline.invalid += 1
+                print(f"Worker: frame {header.seq} de la cámara {camera_id} descartado: {e}")
+                continue
+            if frame is not None:
+                batch.append((pipeline, header, frame))
+        if not batch:
+            return
+
+        # 3. Inferencia por lotes; el tracking se hace por cámara en CameraPipeline.handle
+        t1 = time.time()
+        results = self.predict(batch)
+        t2 = time.time()
+        self._batches += 1
+        self._frames += len(batch)
+
+        for (pipeline, header, frame), result in zip(batch, results):
+            pipeline.handle(header, frame, result)
+        t3 = time.time()
+        # Todos los eventos del lote en un único RPUSH
+        self.events.flush()
+
+        self.stage_time["decode"] += t1 - t0
+        self.stage_time["inference"] += t2 - t1
+        self.stage_time["zones"] += t3 - t2
+        self.stage_time["publish"] += time.time() - t3
+
+    def predict(self, batch) -> list:
+        """Un `Results` por cada (pipeline, header, frame) del lote."""
+        return self.model.predict([frame for _, _, frame in batch], classes=[0], verbose=False)
+
+    def report(self):
+        elapsed = max(time.time() - self._window_start, 1e-6)
+        if self._batches:
+            stages = ", ".join(f"{name} {1000 * seconds / self._batches:.1f}" for name, seconds in self.stage_time.items())
+            print(f"Worker: {self._frames / elapsed:.1f} frames/s en {len(self.pipelines)} cámaras, "
+                  f"lote medio {self._frames / self._batches:.1f}, ms por lote: {stages}")
+        for camera_id, pipeline in self.pipelines.items():
+            # Atraso y frames no inferidos quedan en el mismo hash de stats que la cola y el capture
+            lag = pipeline.lag_report()
+            pipe = self.frames_client.pipeline(transaction=False)
+            pipe.hset(frames_stats_key(camera_id), mapping={
+                "worker_lag_ms": lag["lag_ms"],
+                "worker_lag_max_ms": lag["lag_max_ms"],
+                "worker_infer_every": lag["infer_every"],
+            })
+            pipe.hincrby(frames_stats_key(camera_id), "worker_lag_replaced", lag["replaced"])
+            pipe.hincrby(frames_stats_key(camera_id), "worker_strided", lag["strided"])
+            pipe.hincrby(frames_stats_key(camera_id), "worker_invalid", lag["invalid"])
+            pipe.execute()
+            print(f"Worker: cola cam {camera_id} -> {queue_stats(self.frames_client, camera_id)}, "
+                  f"atraso medio {lag['lag_ms']} ms (máx {lag['lag_max_ms']} ms), "
+                  f"inferencia 1 de cada {lag['infer_every']}, {pipeline.annotation_report()}")
+        self._frames = self._batches = 0
+        self.stage_time = dict.fromkeys(STAGES, 0.0)
+        self._window_start = time.time()
+
+    def run(self):
+        last_stats_ts = time.time()
+        while True:
+            self.step()
+            # Reportar periódicamente throughput, profundidad de colas y frames descartados
+            if time.time() - last_stats_ts >= STATS_INTERVAL:
+                self.report()
+                last_stats_ts = time.time()
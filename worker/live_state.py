@@ -0,0 +1,55 @@
+"""
+Estado en vivo por zona de una cámara, a partir de la máquina de estados de tracks.
+
+Mantiene el dwell de las salidas recientes en una ventana deslizante y decide
+cuándo reescribir el hash de cada zona: si cambió la ocupación o el dwell medio,
+y al menos cada ZONE_STATE_REFRESH_SECONDS para renovar su TTL.
+"""
+import os
+import time
+from collections import deque
+
+from shared.zone_state import encode_zone_state
+
+ZONE_DWELL_WINDOW_SECONDS = float(os.getenv("ZONE_DWELL_WINDOW_SECONDS", 300))
+ZONE_STATE_REFRESH_SECONDS = float(os.getenv("ZONE_STATE_REFRESH_SECONDS", 2.0))
+
+
+class LiveZoneState:
+    def __init__(self, camera_id: int, zone_ids, window: float = ZONE_DWELL_WINDOW_SECONDS):
+        self.camera_id = camera_id
+        self.zone_ids = list(zone_ids)
+        self.window = window
+        # {zone_id: deque[(exit_ts, dwell)]}
+        self._exits = {zone_id: deque() for zone_id in self.zone_ids}
+        self._last_published = {}
+        self._last_publish_ts = 0.0
+
+    def record_exit(self, zone_id: int, ts: float, dwell: float):
+        self._exits[zone_id].append((ts, dwell))
+
+    def _avg_dwell(self, zone_id: int, now: float):
+        exits = self._exits[zone_id]
+        while exits and exits[0][0] < now - self.window:
+            exits.popleft()
+        if not exits:
+            return None
+        return sum(dwell for _, dwell in exits) / len(exits)
+
+    def publish(self, events, occupants, frame_ts: float):
+        """Encola en `events` el estado de las zonas que cambiaron (o todas si toca refrescar el TTL)."""
+        tracks = {zone_id: {} for zone_id in self.zone_ids}
+        for track_id, zone_id, enter_ts in occupants:
+            tracks[zone_id][track_id] = enter_ts
+
+        now = time.time()
+        refresh = now - self._last_publish_ts >= ZONE_STATE_REFRESH_SECONDS
+        for zone_id in self.zone_ids:
+            avg_dwell = self._avg_dwell(zone_id, frame_ts)
+            snapshot = (tuple(sorted(tracks[zone_id])), avg_dwell)
+            if not refresh and self._last_published.get(zone_id) == snapshot:
+                continue
+            events.set_zone_state(zone_id, encode_zone_state(self.camera_id, tracks[zone_id], avg_dwell, now))
+            self._last_published[zone_id] = snapshot
+        if refresh:
+            self._last_publish_ts = now
@@ -0,0 +1,303 @@
+"""
+Estado y procesamiento por cámara del worker.
+
+`CameraPipeline` agrupa todo lo que antes vivía en variables globales de
+worker.py para una sola cámara: zonas, estado de tracks, ring de memoria
+compartida, tracker propio, anotación del frame y eventos de entrada/salida.
+Así un mismo proceso (y un mismo modelo) puede atender a varias cámaras.
+"""
+import os
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+from shared.camera_config import scale_polygon, zone_reference
+from shared.events import event_key
+from shared.frame_codec import ENCODING_BGR, ENCODING_SHM
+from shared.shm_ring import FrameRing
+from shared.viewers import annotated_frame_key, requested_fps
+from worker.inference import apply_tracker, make_tracker, predict_tracker
+from worker.live_state import LiveZoneState
+from worker.tracks import ZoneStateMachine
+from worker.zones import ZoneMask, ZoneOverlay, zone_color
+
+# Tamaño de frame supuesto si la cámara no declara capture_resolution ni zone_resolution
+DEFAULT_FRAME_SIZE = (1280, 720)
+# Cada cuánto se consulta en Redis si alguien está mirando el stream de la cámara
+VIEWERS_POLL_SECONDS = float(os.getenv("VIEWERS_POLL_SECONDS", 0.5))
+# Atraso (edad del frame al inferir) tolerado antes de pasar a inferir 1 de cada N frames
+WORKER_LAG_TARGET_MS = float(os.getenv("WORKER_LAG_TARGET_MS", 250))
+# Rango de N: mínimo fijo (1 = todos los frames) y máximo al que puede subir bajo carga
+WORKER_INFER_EVERY = int(os.getenv("WORKER_INFER_EVERY", 1))
+WORKER_MAX_INFER_EVERY = int(os.getenv("WORKER_MAX_INFER_EVERY", 4))
+# N se ajusta como mucho una vez por este intervalo para no oscilar
+INFER_EVERY_ADJUST_SECONDS = 1.0
+
+
+class CameraPipeline:
+    def __init__(self, tenant_id: int, cam_cfg: dict, redis_client, events):
+        self.tenant_id = tenant_id
+        self.camera_id = cam_cfg["id"]
+        self.redis = redis_client
+        # EventPublisher compartido: los eventos se envían en bloque al final de cada lote
+        self.events = events
+        # Tracker propio por cámara: los IDs y el estado de ByteTrack no se mezclan entre cámaras
+        self.tracker = make_tracker(frame_rate=int(cam_cfg.get("fps", 30)))
+
+        self.zones = {}
+        for z in cam_cfg.get("zones", []):
+            self.zones[z["id"]] = {
+                "points": z["polygon"],
+                # Resolución en la que se dibujó el polígono; se escala al tamaño real del frame
+                "reference": zone_reference(cam_cfg, z),
+                "name": z["name"],
+                "color": zone_color(z),
+                "metrics": z.get("metrics", [])
+            }
+        # Tamaño (ancho, alto) esperado de los frames, para el calentamiento del modelo
+        hint = cam_cfg.get("capture_resolution") or cam_cfg.get("zone_resolution") or DEFAULT_FRAME_SIZE
+        self.frame_size_hint = (int(hint[0]), int(hint[1]))
+        # Tamaño (ancho, alto) de frame para el que están escalados los polígonos
+        self.zones_frame_size = None
+        # Raster de bits de zona y capa de anotación cacheada para ese tamaño de frame
+        self.zone_mask = None
+        self.zone_overlay = None
+
+        # Estado (track, zona) con histéresis: filtra cortes de ByteTrack y bordes de zona
+        self.zone_states = ZoneStateMachine.from_config(cam_cfg)
+        # Ocupación y dwell por zona publicados en Redis para API y alertas
+        self.live_state = LiveZoneState(self.camera_id, self.zones)
+        # Ring de memoria compartida del capture (sólo si corre en este mismo host)
+        self.ring = None
+        # Último seq procesado: los saltos se cubren con predicción del tracker
+        self._last_seq = 0
+
+        # Descarte por atraso: inferencia 1 de cada `infer_every` frames según la edad de los frames
+        self.infer_every = max(1, WORKER_INFER_EVERY)
+        self._since_inferred = 0
+        self._lag_ewma = None
+        self._infer_every_changed_ts = 0.0
+        self._lag_sum = 0.0
+        self._lag_max = 0.0
+        self._lag_count = 0
+        self.lag_replaced = 0
+        self.strided = 0
+        # Mensajes de la cola que no se pudieron leer (ver BatchedInferenceServer._decode_all)
+        self.invalid = 0
+
+        # Anotación bajo demanda: sólo se dibuja y codifica si alguien mira el stream
+        self._viewer_fps = None
+        self._viewers_checked_ts = 0.0
+        self._last_annotated_ts = 0.0
+        self.annotated = 0
+        self.annotation_skipped = 0
+        self.annotation_time = 0.0
+
+    # --- Entrada de frames ---
+
+    def decode_payload(self, header, frame_payload):
+        """Devuelve el frame BGR del payload ya separado de su header, o None si no se pudo."""
+        if header.encoding == ENCODING_SHM:
+            # Zero-copy: vista NumPy directa sobre el slot del ring
+            frame = self._read_shm_frame(header)
+        elif header.encoding == ENCODING_BGR:
+            # Píxeles crudos: se mapean sobre el buffer recibido sin copiar
+            frame = np.frombuffer(frame_payload, dtype=np.uint8).reshape(header.height, header.width, 3)
+        else:
+            # cv2 devuelve BGR, que es lo que YOLO espera para arrays de numpy
+            frame = cv2.imdecode(np.frombuffer(frame_payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"Worker: no se pudo decodificar el frame {header.seq} de la cámara {self.camera_id}")
+        return frame
+
+    def _read_shm_frame(self, header):
+        """Devuelve la vista del frame en el ring, (re)conectándose si el capture lo recreó."""
+        if self.ring is None or self.ring.shape != (header.height, header.width, 3):
+            if self.ring is not None:
+                self.ring.close()
+            try:
+                self.ring = FrameRing.attach(self.camera_id)
+            except FileNotFoundError:
+                print(f"Worker: no hay ring de memoria compartida para la cámara {self.camera_id} en este host; "
+                      f"usar FRAME_TRANSPORT=redis en el capture para workers remotos")
+                self.ring = None
+                return None
+        entry = self.ring.read(header.seq)
+        if entry is None:
+            # Slot sobreescrito porque el worker va atrasado: se descarta el frame sin soltar el ring.
+            # Sólo se reconecta si el capture se reinició y recreó el segmento
+            if self.ring.is_stale():
+                self.ring.close()
+                self.ring = None
+            return None
+        return entry[1]
+
+    def frame_still_valid(self, header) -> bool:
+        """False si el capture sobreescribió el slot del ring mientras se hacía la inferencia."""
+        if header.encoding != ENCODING_SHM or self.ring is None:
+            return True
+        return self.ring.is_current(header.seq)
+
+    def _scale_zones(self, frame_size):
+        """Reescala los polígonos de zona si cambia la resolución de los frames (p. ej. capture_resolution)."""
+        if frame_size == self.zones_frame_size:
+            return
+        scaled = {
+            zone_id: scale_polygon(zinfo["points"], zinfo["reference"], frame_size)
+            for zone_id, zinfo in self.zones.items()
+        }
+        self.zone_mask = ZoneMask(scaled, frame_size)
+        self.zone_overlay = ZoneOverlay(
+            {zone_id: (scaled[zone_id], zinfo["name"], zinfo["color"]) for zone_id, zinfo in self.zones.items()},
+            frame_size,
+        )
+        self.zones_frame_size = frame_size
+
+    # --- Descarte por atraso ---
+
+    def should_infer(self, header, now: float) -> bool:
+        """
+        Registra la edad del frame y decide si pasa por el modelo. Si el atraso
+        medio supera WORKER_LAG_TARGET_MS se infiere 1 de cada N frames (N sube
+        hasta WORKER_MAX_INFER_EVERY) y baja de nuevo cuando el atraso se recupera.
+        """
+        lag = max(0.0, now - header.ts)
+        self._lag_sum += lag
+        self._lag_count += 1
+        self._lag_max = max(self._lag_max, lag)
+        self._lag_ewma = lag if self._lag_ewma is None else 0.8 * self._lag_ewma + 0.2 * lag
+
+        if now - self._infer_every_changed_ts >= INFER_EVERY_ADJUST_SECONDS:
+            target = WORKER_LAG_TARGET_MS / 1000.0
+            if self._lag_ewma > target and self.infer_every < WORKER_MAX_INFER_EVERY:
+                self.infer_every += 1
+                self._infer_every_changed_ts = now
+                print(f"Worker: cam {self.camera_id} atrasada {1000 * self._lag_ewma:.0f} ms, "
+                      f"inferencia 1 de cada {self.infer_every} frames")
+            elif self._lag_ewma < target / 2 and self.infer_every > max(1, WORKER_INFER_EVERY):
+                self.infer_every -= 1
+                self._infer_every_changed_ts = now
+
+        self._since_inferred += 1
+        if self._since_inferred < self.infer_every:
+            self.strided += 1
+            return False
+        self._since_inferred = 0
+        return True
+
+    def lag_report(self) -> dict:
+        """Atraso medio/máximo y frames reemplazados u omitidos desde el último reporte."""
+        report = {
+            "lag_ms": round(1000 * self._lag_sum / self._lag_count, 1) if self._lag_count else 0.0,
+            "lag_max_ms": round(1000 * self._lag_max, 1),
+            "infer_every": self.infer_every,
+            "replaced": self.lag_replaced,
+            "strided": self.strided,
+            "invalid": self.invalid,
+        }
+        self._lag_sum = self._lag_max = 0.0
+        self._lag_count = self.lag_replaced = self.strided = self.invalid = 0
+        return report
+
+    # --- Procesamiento de resultados ---
+
+    def handle(self, header, frame, results):
+        """Aplica el tracker de la cámara a las detecciones y procesa anotación y eventos."""
+        if not self.frame_still_valid(header):
+            # El capture sobreescribió el slot mientras lo leíamos: resultado no confiable
+            print(f"Worker: frame {header.seq} sobreescrito en el ring durante la inferencia, descartado")
+            return
+        # Frames que no llegaron al modelo (descartados en la cola o por 1 de cada N):
+        # el tracker predice esos pasos para que la asociación no compare contra posiciones viejas
+        if self._last_seq and header.seq > self._last_seq + 1:
+            predict_tracker(self.tracker, min(header.seq - self._last_seq - 1, self.tracker.max_time_lost))
+        self._last_seq = header.seq
+        results = apply_tracker(self.tracker, results)
+        self._scale_zones((frame.shape[1], frame.shape[0]))
+        if self._should_annotate():
+            t0 = time.time()
+            self._annotate(results)
+            self.annotation_time += time.time() - t0
+            self.annotated += 1
+        else:
+            self.annotation_skipped += 1
+        # Los eventos llevan la hora de captura del frame, no la de procesamiento
+        self._update_zones(results, header.ts, header.seq)
+
+    def _should_annotate(self) -> bool:
+        """True si hay espectadores y toca un frame según los fps que pidieron."""
+        now = time.time()
+        if now - self._viewers_checked_ts >= VIEWERS_POLL_SECONDS:
+            self._viewer_fps = requested_fps(self.redis, self.camera_id)
+            self._viewers_checked_ts = now
+        if not self._viewer_fps:
+            return False
+        if now - self._last_annotated_ts < 1.0 / self._viewer_fps:
+            return False
+        self._last_annotated_ts = now
+        return True
+
+    def annotation_report(self) -> str:
+        """Resumen de anotaciones hechas/omitidas y CPU estimada ahorrada desde el último reporte."""
+        total = self.annotated + self.annotation_skipped
+        report = f"anotados {self.annotated}/{total} frames"
+        if self.annotated:
+            # El costo medio de una anotación estima la CPU ahorrada por las omitidas
+            avg = self.annotation_time / self.annotated
+            report += f", ~{avg * self.annotation_skipped:.1f} s de CPU ahorrados ({1000 * avg:.1f} ms por anotación)"
+        self.annotated = self.annotation_skipped = 0
+        self.annotation_time = 0.0
+        return report
+
+    def _annotate(self, results):
+        # 4. DIBUJAR ANOTACIONES Y ENVIAR A REDIS PARA EL STREAM DE VIDEO
+        # El método plot() de ultralytics convenientemente devuelve el frame con las cajas dibujadas.
+        annotated_frame = results.plot()
+
+        # DIBUJAR POLÍGONOS DE LAS ZONAS
+        # La capa de zonas (relleno, bordes y etiquetas) está pre-renderizada: un solo blend por frame
+        self.zone_overlay.apply(annotated_frame)
+
+        # Codificar el frame dibujado a JPEG para la transmisión
+        ok, buffer = cv2.imencode('.jpg', annotated_frame)
+        if ok:
+            frame_bytes = buffer.tobytes()
+            # Guardamos el frame en una clave simple, sobrescribiendo la anterior.
+            # Es más eficiente para un stream de video que una lista.
+            self.redis.set(annotated_frame_key(self.camera_id), frame_bytes)
+
+    def _update_zones(self, results, frame_ts: float, seq: int):
+        # 5. Lógica de Eventos de Entrada/Salida de Zona
+        # Pertenencia de todos los centroides a todas las zonas en un solo lookup sobre el raster
+        inside = set()
+        present = set()
+        if results.boxes.id is not None:
+            track_ids = results.boxes.id.int().cpu().numpy()
+            xyxy = results.boxes.xyxy.cpu().numpy()
+            cx = (xyxy[:, 0] + xyxy[:, 2]) / 2
+            cy = (xyxy[:, 1] + xyxy[:, 3]) / 2
+            inside = self.zone_mask.pairs(track_ids, cx, cy)
+            present = set(track_ids.tolist())
+
+        # Sólo se emiten las transiciones confirmadas, con el instante real de entrada/salida
+        for event, track_id, zone_id, ts, enter_ts in self.zone_states.update(inside, present, frame_ts):
+            evt = {
+                "tenant_id": self.tenant_id,
+                "camera_id": self.camera_id,
+                "zone_id": zone_id,
+                "track_id": track_id,
+                "event": event,
+                "ts": datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat() + "Z",
+                # Misma transición, misma clave: ingest descarta las filas repetidas
+                "event_key": event_key(self.camera_id, track_id, zone_id, event, seq),
+            }
+            if event == "exit":
+                self.live_state.record_exit(zone_id, ts, ts - enter_ts)
+                if 'dwell' in self.zones[zone_id].get('metrics', []):
+                    evt['dwell'] = ts - enter_ts
+
+            self.events.add(evt, self.zones[zone_id]["name"])
+
+        self.live_state.publish(self.events, self.zone_states.occupants(), frame_ts)
@@ -0,0 +1,127 @@
+"""
+Máquina de estados de entrada/salida de zonas con histéresis.
+
+Un par (track, zona) sólo emite `enter` tras `enter_frames` frames seguidos
+dentro, y sólo emite `exit` tras `exit_frames` frames seguidos fuera o si el
+track falta de `missing_frames` frames procesados seguidos y durante más de
+`missing_grace_seconds`. Así los cortes de ByteTrack y las personas paradas
+sobre el borde de un polígono ya no generan ráfagas de pares enter/exit. Las
+dos condiciones para un track perdido hacen falta porque con el filtro de
+movimiento una escena quieta sólo llega en frames de keep-alive cada varios
+segundos: un único frame sin detección ya supera cualquier margen en segundos.
+
+No depende del modelo ni de Redis: recibe, por frame, los pares
+(track_id, zone_id) que están dentro y los tracks presentes, y devuelve los
+eventos confirmados. Con enter_frames=1, exit_frames=1, missing_frames=1 y
+grace=0 reproduce el comportamiento anterior (un evento por cada cambio de un frame a otro).
+"""
+import os
+
+ZONE_ENTER_FRAMES = int(os.getenv("ZONE_ENTER_FRAMES", 3))
+ZONE_EXIT_FRAMES = int(os.getenv("ZONE_EXIT_FRAMES", 5))
+TRACK_MISSING_FRAMES = int(os.getenv("TRACK_MISSING_FRAMES", 3))
+TRACK_MISSING_GRACE_SECONDS = float(os.getenv("TRACK_MISSING_GRACE_SECONDS", 2.0))
+
+PENDING = 0
+INSIDE = 1
+
+
+class ZoneTrackState:
+    __slots__ = ("state", "inside_streak", "outside_streak", "missing_streak", "first_inside_ts",
+                 "first_outside_ts", "enter_ts", "last_seen_ts")
+
+    def __init__(self, now: float):
+        self.state = PENDING
+        self.inside_streak = 0
+        self.outside_streak = 0
+        self.missing_streak = 0
+        self.first_inside_ts = now
+        self.first_outside_ts = 0.0
+        self.enter_ts = 0.0
+        self.last_seen_ts = now
+
+
+class ZoneStateMachine:
+    def __init__(self, enter_frames: int = ZONE_ENTER_FRAMES, exit_frames: int = ZONE_EXIT_FRAMES,
+                 missing_grace_seconds: float = TRACK_MISSING_GRACE_SECONDS,
+                 missing_frames: int = TRACK_MISSING_FRAMES):
+        self.enter_frames = max(1, enter_frames)
+        self.exit_frames = max(1, exit_frames)
+        self.missing_frames = max(1, missing_frames)
+        self.missing_grace_seconds = missing_grace_seconds
+        # {(track_id, zone_id): ZoneTrackState}
+        self.table = {}
+
+    @classmethod
+    def from_config(cls, cam_cfg: dict) -> "ZoneStateMachine":
+        """Permite sobreescribir los umbrales por cámara con la sección `hysteresis` de config.yaml."""
+        cfg = cam_cfg.get("hysteresis") or {}
+        return cls(
+            enter_frames=int(cfg.get("enter_frames", ZONE_ENTER_FRAMES)),
+            exit_frames=int(cfg.get("exit_frames", ZONE_EXIT_FRAMES)),
+            missing_grace_seconds=float(cfg.get("missing_grace_seconds", TRACK_MISSING_GRACE_SECONDS)),
+            missing_frames=int(cfg.get("missing_frames", TRACK_MISSING_FRAMES)),
+        )
+
+    def update(self, inside: set, present_tracks: set, now: float) -> list:
+        """
+        Avanza un frame. Devuelve una lista de eventos confirmados
+        (event, track_id, zone_id, ts, enter_ts), donde `ts` es el instante real
+        de la transición (primer frame dentro / fuera, o última vez visto dentro).
+        """
+        events = []
+
+        for key in inside:
+            st = self.table.get(key)
+            if st is None:
+                st = self.table[key] = ZoneTrackState(now)
+            if st.inside_streak == 0:
+                st.first_inside_ts = now
+            st.inside_streak += 1
+            st.outside_streak = 0
+            st.missing_streak = 0
+            st.last_seen_ts = now
+            if st.state == PENDING and st.inside_streak >= self.enter_frames:
+                st.state = INSIDE
+                st.enter_ts = st.first_inside_ts
+                events.append(("enter", key[0], key[1], st.enter_ts, st.enter_ts))
+
+        finished = []
+        for key, st in self.table.items():
+            if key in inside:
+                continue
+            track_id = key[0]
+            st.inside_streak = 0
+
+            if track_id in present_tracks:
+                # El track sigue visible pero fuera de la zona
+                st.last_seen_ts = now
+                st.missing_streak = 0
+                if st.outside_streak == 0:
+                    st.first_outside_ts = now
+                st.outside_streak += 1
+                if st.state == PENDING:
+                    finished.append(key)
+                elif st.outside_streak >= self.exit_frames:
+                    events.append(("exit", track_id, key[1], st.first_outside_ts, st.enter_ts))
+                    finished.append(key)
+            elif st.state == PENDING:
+                finished.append(key)
+            else:
+                st.missing_streak += 1
+                if st.missing_streak >= self.missing_frames and now - st.last_seen_ts >= self.missing_grace_seconds:
+                    # El track desapareció (salió de cámara o ByteTrack lo perdió) más allá del margen.
+                    # Si antes de perderse ya se lo veía fuera, la salida fue en el primer frame fuera
+                    exit_ts = st.first_outside_ts if st.outside_streak else st.last_seen_ts
+                    events.append(("exit", track_id, key[1], exit_ts, st.enter_ts))
+                    finished.append(key)
+
+        for key in finished:
+            del self.table[key]
+        return events
+
+    def occupants(self):
+        """Itera (track_id, zone_id, enter_ts) de los tracks confirmados dentro de cada zona."""
+        for (track_id, zone_id), st in self.table.items():
+            if st.state == INSIDE:
+                yield track_id, zone_id, st.enter_ts
@@ -0,0 +1,124 @@
+"""
+Pertenencia a zonas vectorizada con un raster de bits precalculado.
+
+Para cada cámara se rasteriza una vez (al arrancar o al cambiar la resolución
+del frame) una imagen del tamaño del frame donde el bit `i` de cada píxel indica
+si pertenece a la zona `i`. Las zonas superpuestas simplemente encienden varios
+bits. La pertenencia de todos los centroides del frame es entonces un único
+fancy-index de NumPy en lugar de un `Polygon.contains(Point)` por track y zona.
+El resultado coincide con shapely salvo para puntos a menos de un píxel del borde.
+"""
+import cv2
+import numpy as np
+
+# Subpíxeles de fillPoly (2**4 = 1/16 de píxel) para respetar coordenadas no enteras
+_SHIFT = 4
+
+
+def _bits_dtype(n_zones: int):
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_zones <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"Demasiadas zonas para una cámara ({n_zones}); el máximo es 64")
+
+
+class ZoneMask:
+    def __init__(self, polygons: dict, frame_size):
+        """
+        `polygons` es {zone_id: [(x, y), ...]} en coordenadas del frame y
+        `frame_size` es (ancho, alto).
+        """
+        self.zone_ids = np.array(list(polygons), dtype=np.int64)
+        self.width, self.height = frame_size
+        dtype = _bits_dtype(len(polygons))
+        self.raster = np.zeros((self.height, self.width), dtype=dtype)
+
+        layer = np.zeros((self.height, self.width), dtype=np.uint8)
+        for bit, points in enumerate(polygons.values()):
+            layer[:] = 0
+            pts = np.round(np.asarray(points, dtype=np.float64) * (1 << _SHIFT)).astype(np.int32)
+            cv2.fillPoly(layer, [pts.reshape((-1, 1, 2))], 1, lineType=cv2.LINE_8, shift=_SHIFT)
+            self.raster |= layer.astype(dtype) << dtype(bit)
+
+    def lookup(self, xs, ys) -> np.ndarray:
+        """Bits de zona de cada punto; 0 para los que caen fuera del frame."""
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        xi = np.rint(xs).astype(np.int64)
+        yi = np.rint(ys).astype(np.int64)
+        valid = (xi >= 0) & (xi < self.width) & (yi >= 0) & (yi < self.height)
+        bits = np.zeros(xi.shape, dtype=self.raster.dtype)
+        bits[valid] = self.raster[yi[valid], xi[valid]]
+        return bits
+
+    def membership(self, xs, ys) -> np.ndarray:
+        """Matriz booleana (puntos x zonas), en el orden de `zone_ids`."""
+        bits = self.lookup(xs, ys)
+        shifts = np.arange(len(self.zone_ids), dtype=bits.dtype)
+        return ((bits[:, None] >> shifts) & 1).astype(bool)
+
+    def pairs(self, track_ids, xs, ys) -> set:
+        """Conjunto de (track_id, zone_id) para los tracks que están dentro de cada zona."""
+        if len(track_ids) == 0:
+            return set()
+        rows, cols = np.nonzero(self.membership(xs, ys))
+        track_ids = np.asarray(track_ids)
+        return set(zip(track_ids[rows].tolist(), self.zone_ids[cols].tolist()))
+
+
+DEFAULT_ZONE_COLOR = (255, 255, 255)
+
+
+def zone_color(zone_cfg: dict):
+    """
+    Color BGR de la zona desde config.yaml: `color: "#RRGGBB"` o `color: [b, g, r]`.
+    Blanco si no se declara.
+    """
+    color = zone_cfg.get("color")
+    if not color:
+        return DEFAULT_ZONE_COLOR
+    if isinstance(color, str):
+        rgb = color.lstrip("#")
+        return (int(rgb[4:6], 16), int(rgb[2:4], 16), int(rgb[0:2], 16))
+    return tuple(int(c) for c in color)
+
+
+class ZoneOverlay:
+    """
+    Capa de zonas (relleno, bordes y etiquetas) renderizada una sola vez por
+    tamaño de frame. Aplicarla cuesta un blend de frame completo y dos copias
+    con máscara, en lugar de una copia + blend + dibujo por zona y frame.
+    """
+
+    def __init__(self, zones: dict, frame_size, alpha: float = 0.2):
+        """`zones` es {zone_id: (puntos, nombre, color_bgr)} en coordenadas del frame."""
+        # Import diferido: shapely sólo hace falta para ubicar las etiquetas, no en el arranque
+        from shapely.geometry import Polygon
+
+        width, height = frame_size
+        self.alpha = alpha
+        self.fill = np.zeros((height, width, 3), dtype=np.uint8)
+        self.fill_mask = np.zeros((height, width), dtype=np.uint8)
+        self.lines = np.zeros((height, width, 3), dtype=np.uint8)
+        self.lines_mask = np.zeros((height, width), dtype=np.uint8)
+
+        for zone_id, (points, name, color) in zones.items():
+            poly_points = np.array(points, dtype=np.int32).reshape((-1, 1, 2))
+            cv2.fillPoly(self.fill, [poly_points], color)
+            cv2.fillPoly(self.fill_mask, [poly_points], 255)
+
+            # Bordes y etiquetas se dibujan opacos, igual que antes sobre el frame
+            cv2.polylines(self.lines, [poly_points], True, color, 2)
+            cv2.polylines(self.lines_mask, [poly_points], True, 255, 2)
+            centroid = Polygon(points).centroid
+            label = f"Zone {zone_id}: {name}"
+            org = (int(centroid.x), int(centroid.y))
+            cv2.putText(self.lines, label, org, cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            cv2.putText(self.lines_mask, label, org, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255, 2)
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Dibuja la capa sobre `frame` (in place) y lo devuelve."""
+        blended = cv2.addWeighted(self.fill, self.alpha, frame, 1.0 - self.alpha, 0)
+        cv2.copyTo(blended, self.fill_mask, frame)
+        cv2.copyTo(self.lines, self.lines_mask, frame)
+        return frame